@@ -0,0 +1,222 @@
+"""Benchmark the pipeline stages on synthetic data.
+
+Usage, from the repository root (or with the package installed):
+    python -m benchmarks.bench run --sizes 1000000,10000000,28000000 --output results.json
+    python -m benchmarks.bench compare base.json results.json
+
+Each stage runs in a fresh process on inputs materialised beforehand, so its wall time and peak
+RSS are measured in isolation. Results are written as JSON together with the commit and library
+versions, and ``compare`` reports the ratio between two result files.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import polars as pl
+
+from gimmecpg_python.files import BED_COLUMNS, collapse_sorted, collapse_strands, read_files
+from gimmecpg_python.impute import fast_impute, h2oPrep
+from gimmecpg_python.missing import missing_sites
+from gimmecpg_python.reference import build_reference, reference_meta, scan_reference
+from gimmecpg_python.report import peak_rss_mb
+from gimmecpg_python.synthetic import write_dataset
+
+MIN_COV = 10
+MAX_DISTANCE = 1000
+
+
+def parquet_rows(path):
+    """Row count from parquet metadata."""
+    return pl.scan_parquet(path).select(pl.len()).collect().item()
+
+
+def raw_bed(bed):
+    """Bed columns as read_files selects them, before collapsing."""
+    return (
+        pl.scan_csv(bed, separator="\t", skip_rows=1, has_header=False)
+        .select(list(BED_COLUMNS))
+        .rename(BED_COLUMNS)
+        .with_columns(pl.col("chr").str.replace_all(r"(?i)Chr", ""))
+        .cast({"start": pl.UInt64, "end": pl.UInt64, "coverage": pl.UInt64, "percent_methylated": pl.UInt64})
+    )
+
+
+def prepare(workdir, size, seed):
+    """Generate data for one size and materialise every stage's input."""
+    workdir = Path(workdir, str(size))
+    paths = {
+        "bed": workdir / "beds" / "sample_0.bed",
+        "raw": workdir / "raw.parquet",
+        "observed": workdir / "observed.parquet",
+        "missing": workdir / "missing.parquet",
+    }
+    if all(path.exists() for path in paths.values()):
+        paths["index"] = build_reference(workdir / "ref.parquet", None, workdir)
+        return paths
+
+    ref, _ = write_dataset(workdir, size, n_samples=1, seed=seed)
+    paths["index"] = build_reference(ref, None, workdir)
+    raw_bed(paths["bed"]).collect().write_parquet(paths["raw"])
+    read_files(paths["bed"], MIN_COV, True).collect().write_parquet(paths["observed"])
+    chromosomes = list(reference_meta(paths["index"])["chromosomes"])
+    observed = pl.scan_parquet(paths["observed"])
+    missing_sites(observed, scan_reference(paths["index"]), chromosomes).collect().write_parquet(paths["missing"])
+    return paths
+
+
+def stage_read_files(paths):
+    """Parse, collapse and coverage-filter a bed file."""
+    return None, read_files(paths["bed"], MIN_COV, True).collect().height
+
+
+def stage_collapse_strands(paths):
+    """Collapse strands of a parsed bed file."""
+    return parquet_rows(paths["raw"]), collapse_strands(pl.scan_parquet(paths["raw"])).collect().height
+
+
+def stage_collapse_sorted(paths):
+    """Collapse strands of a parsed, position-sorted bed file in one pass."""
+    return parquet_rows(paths["raw"]), collapse_sorted(pl.scan_parquet(paths["raw"])).collect().height
+
+
+def stage_missing_sites(paths):
+    """Align observed sites to the reference and find neighbours within the distance cutoff."""
+    chromosomes = list(reference_meta(paths["index"])["chromosomes"])
+    observed = pl.scan_parquet(paths["observed"])
+    res = missing_sites(observed, scan_reference(paths["index"]), chromosomes, MAX_DISTANCE).collect()
+    return parquet_rows(paths["observed"]), res.height
+
+
+def stage_fast_impute(paths):
+    """Distance-weighted imputation."""
+    res = fast_impute(pl.scan_parquet(paths["missing"]), MAX_DISTANCE).collect()
+    return parquet_rows(paths["missing"]), res.height
+
+
+def stage_h2oPrep(paths):
+    """Build training and prediction features."""
+    features, to_predict, _ = h2oPrep(pl.scan_parquet(paths["missing"]), MAX_DISTANCE, False)
+    return parquet_rows(paths["missing"]), features.height + to_predict.height
+
+
+STAGES = {
+    "read_files": stage_read_files,
+    "collapse_strands": stage_collapse_strands,
+    "collapse_sorted": stage_collapse_sorted,
+    "missing_sites": stage_missing_sites,
+    "fast_impute": stage_fast_impute,
+    "h2oPrep": stage_h2oPrep,
+}
+
+
+def measure(stage, paths):
+    """Run one stage and measure it (called in a fresh process)."""
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    rows_in, rows_out = STAGES[stage](paths)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "stage_rss_mb": peak_rss_mb() - baseline,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+    }
+
+
+def git_commit():
+    """Current commit, if any."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Run the benchmark suite."""
+    results = []
+    ctx = get_context("spawn")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"Preparing {size} sites")
+        with ProcessPoolExecutor(1, mp_context=ctx) as executor:
+            paths = executor.submit(prepare, args.workdir, size, args.seed).result()
+
+        for stage in args.stages.split(",") if args.stages else STAGES:
+            runs = []
+            for _ in range(args.repeat):
+                with ProcessPoolExecutor(1, mp_context=ctx) as executor:
+                    runs.append(executor.submit(measure, stage, paths).result())
+            best = min(runs, key=lambda res: res["seconds"])
+            best["peak_rss_mb"] = max(res["peak_rss_mb"] for res in runs)
+            results.append({"size": size, "stage": stage, "repeats": args.repeat, **best})
+            print(f"{size:>10} {stage:<17} {best['seconds']:8.2f}s {best['peak_rss_mb']:9.1f} MB")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+
+def compare(args):
+    """Compare two result files; exit with 1 if any stage got slower than the threshold."""
+    base, new = (json.loads(Path(path).read_text()) for path in (args.base, args.new))
+    base_results = {(res["size"], res["stage"]): res for res in base["results"]}
+
+    print(f"{'size':>10} {'stage':<17} {'time':>7} {'memory':>7}")
+    regressed = False
+    for res in new["results"]:
+        old = base_results.get((res["size"], res["stage"]))
+        if old is None:
+            continue
+        time_ratio = res["seconds"] / old["seconds"]
+        mem_ratio = res["peak_rss_mb"] / old["peak_rss_mb"]
+        flag = " <-- slower" if time_ratio > args.threshold else ""
+        regressed |= bool(flag)
+        print(f"{res['size']:>10} {res['stage']:<17} {time_ratio:6.2f}x {mem_ratio:6.2f}x{flag}")
+
+    return 1 if regressed else 0
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="GIMMEcpg stage benchmarks on synthetic data")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--sizes", default="1000000,10000000,28000000", help="Comma-separated CpG counts")
+    run_parser.add_argument("--stages", help=f"Comma-separated subset of: {','.join(STAGES)}")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is kept")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--workdir", default="bench_data", help="Where synthetic data is generated and cached")
+    run_parser.add_argument("--output", default="bench_results.json")
+
+    compare_parser = sub.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=1.1, help="Time ratio flagged as a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
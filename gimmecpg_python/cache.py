@@ -0,0 +1,72 @@
+"""Cache of parsed, filtered bed files."""
+
+import hashlib
+import json
+import os
+import socket
+import tempfile
+from pathlib import Path
+
+import polars as pl
+
+from .files import ROW_GROUP_SIZE, read_files, sample_name
+from .manifest import fingerprint
+
+CACHE_VERSION = 1
+
+
+def input_key(bed, mincov, collapse, approx=False, presorted=False):
+    """Hash of a bed file's fingerprint and the options that decide its parsed sites."""
+    key = {
+        "version": CACHE_VERSION,
+        "input": fingerprint(bed),
+        "minCov": mincov,
+        "collapse": collapse,
+        "approxQuantile": approx,
+        "sortedInput": presorted,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def cache_file(bed, mincov, collapse, cache_dir, approx=False, presorted=False):
+    """Path of a bed file's cached sites (see ``cache_input``), whether or not it exists yet."""
+    return Path(cache_dir, f"{sample_name(bed)}_{input_key(bed, mincov, collapse, approx, presorted)[:16]}.parquet")
+
+
+def cache_input(bed, mincov, collapse, cache_dir, approx=False, presorted=False):
+    """Write a bed file's cleaned, strand-collapsed and coverage-filtered sites once, as sorted parquet.
+
+    The file lives in ``cache_dir`` under the sample name and a hash of the input fingerprint (see
+    ``manifest.fingerprint``), ``mincov``, ``collapse``, ``approx`` and ``presorted``, so runs that only change
+    other options scan it instead of parsing the bed file again.
+    """
+    name = sample_name(bed)
+    outfile = cache_file(bed, mincov, collapse, cache_dir, approx, presorted)
+
+    if outfile.exists():
+        return outfile
+
+    print(f"Caching parsed {name} in {outfile}")
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="gimmecpg_") as tmpdir:
+        data = read_files(bed, mincov, collapse, approx=approx, presorted=presorted, tmpdir=tmpdir).collect()
+
+    tmp = outfile.with_suffix(f".tmp{socket.gethostname()}_{os.getpid()}")  # units on other nodes may build it too
+    data.sort(["chr", "start"]).write_parquet(tmp, statistics=True, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp, outfile)  # publish the finished file in one step
+
+    return outfile
+
+
+def scan_input(bed, mincov, collapse, schema=None, approx=False, cache_dir=None, presorted=False, tmpdir=None):
+    """``files.read_files``, scanning the cached parquet (built on first use) when ``cache_dir`` is set."""
+    if cache_dir is None:
+        return read_files(bed, mincov, collapse, schema, approx, presorted, tmpdir)
+
+    data = pl.scan_parquet(cache_input(bed, mincov, collapse, cache_dir, approx, presorted))
+    print(f"Scanning {sample_name(bed)} from cache")
+    if schema:
+        data = data.filter(pl.col("chr").is_in(schema["chr"].categories)).cast(
+            {col: schema[col] for col in ("chr", "start", "avg")}
+        )
+    return data
@@ -0,0 +1,251 @@
+"""Split a cohort into work units that separate processes or nodes run through a shared filesystem.
+
+Usage:
+    python -m gimmecpg_python.cluster plan shards.json -- -i beds -r ref.parquet -o out -d 500
+    python -m gimmecpg_python.cluster run-shard shards.json --unit 0  # e.g. one array job per unit
+    python -m gimmecpg_python.cluster merge shards.json
+
+``plan`` takes the same options as ``main.py`` and writes a shard manifest of (sample, chromosome
+range) units, ``run-shard`` imputes one unit and ``merge`` stitches the units of each sample into
+its output once every unit is done. The only coordination is through files next to the manifest.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import sys
+from dataclasses import asdict
+from pathlib import Path
+
+import polars as pl
+
+from .cache import scan_input
+from .files import imputed_sites, sample_name, sink_files, standard_dtypes
+from .impute import fast_impute
+from .main import build_parser, find_beds
+from .manifest import RunManifest
+from .missing import missing_sites
+from .pipeline import Config, Pipeline
+from .reference import build_reference, compact_schema, reference_meta, scan_reference
+
+SHARD_MANIFEST_VERSION = 1
+UNIT_SITES = 5_000_000  # reference sites per work unit
+
+
+def chromosome_ranges(index, chrom, unit_sites=UNIT_SITES):
+    """Split a chromosome of the reference index into ``[start, end)`` ranges of ``unit_sites`` sites.
+
+    The last range is open-ended (``end`` is ``None``).
+    """
+    starts = (
+        pl.scan_parquet(Path(index, reference_meta(index)["chromosomes"][chrom]["file"]))
+        .select(pl.col("start").gather_every(unit_sites))
+        .collect()
+        .to_series()
+        .to_list()
+    )
+    bounds = [0, *starts[1:], None]
+    return list(itertools.pairwise(bounds))
+
+
+def plan_units(config, bed_paths, manifest_path, unit_sites=UNIT_SITES):
+    """Build the reference index and write the shard manifest; returns the manifest."""
+    if config.ml or config.regions:
+        raise ValueError("Shard manifests only support genome-wide default imputation.")
+
+    index = build_reference(config.ref, config.exclude, config.refIndex or Path(config.ref).parent)
+    workdir = Path(manifest_path).resolve().with_suffix("")
+    ranges = {chrom: chromosome_ranges(index, chrom, unit_sites) for chrom in reference_meta(index)["chromosomes"]}
+
+    units = []
+    for bed in bed_paths:
+        name = sample_name(bed)
+        for chrom, chrom_ranges in ranges.items():
+            for part, (start, end) in enumerate(chrom_ranges):
+                units.append(
+                    {
+                        "id": f"{name}_chr{chrom}_{part}",
+                        "sample": name,
+                        "bed": str(Path(bed).resolve()),
+                        "chr": chrom,
+                        "start": start,
+                        "end": end,
+                    }
+                )
+
+    manifest = {
+        "version": SHARD_MANIFEST_VERSION,
+        "config": asdict(config),
+        "reference_index": str(Path(index).resolve()),
+        "workdir": str(workdir),
+        "units": units,
+    }
+    (workdir / "units").mkdir(parents=True, exist_ok=True)
+    write_atomic(Path(manifest_path), json.dumps(manifest, indent=2))
+    return manifest
+
+
+def write_atomic(path, text):
+    """Write a file so that readers on any node see either nothing or all of it."""
+    tmp = path.with_suffix(f".tmp{socket.gethostname()}_{os.getpid()}")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def load_manifest(manifest_path):
+    """Read a shard manifest."""
+    manifest = json.loads(Path(manifest_path).read_text())
+    if manifest["version"] != SHARD_MANIFEST_VERSION:
+        raise ValueError(f"Unsupported shard manifest version {manifest['version']}.")
+    return manifest
+
+
+def unit_file(manifest, unit):
+    """Output of a work unit; it only exists once the unit is done."""
+    return Path(manifest["workdir"], "units", f"{unit['id']}.parquet")
+
+
+def find_unit(manifest, unit):
+    """A unit by position in the manifest or by id."""
+    if str(unit).isdigit():
+        return manifest["units"][int(unit)]
+    for candidate in manifest["units"]:
+        if candidate["id"] == unit:
+            return candidate
+    raise ValueError(f"No work unit {unit} in the shard manifest.")
+
+
+def run_unit(manifest, unit):
+    """Impute the reference sites of one work unit; returns the rows written.
+
+    Observed and reference sites are read ``maxDistance`` bases either side of the range (the whole
+    chromosome without a limit), so sites near the range ends find the same neighbours as in a whole run.
+    Bed files are parsed once into the input cache (``inputCache``, or ``inputs`` next to the
+    units) and every unit of the sample scans it.
+    """
+    c = Config(**manifest["config"])
+    index = manifest["reference_index"]
+    schema = compact_schema(index) if c.compact else None
+    cache = c.inputCache or Path(manifest["workdir"], "inputs")
+    chrom, start, end = unit["chr"], unit["start"], unit["end"]
+
+    # observed sites only count at reference positions, so the reference is read over the same window
+    window = pl.lit(True)
+    if c.maxDistance > 0:
+        window = pl.col("start") >= max(start - c.maxDistance, 0)
+        if end is not None:
+            window = window & (pl.col("start") < end + c.maxDistance)
+    in_unit = pl.col("start") >= start
+    if end is not None:
+        in_unit = in_unit & (pl.col("start") < end)
+
+    ref = scan_reference(index, [chrom], schema).filter(window)
+    bed = scan_input(unit["bed"], c.minCov, c.collapse, schema, c.approxQuantile, cache, c.sortedInput)
+    bed = bed.filter((pl.col("chr") == chrom) & window)
+
+    missing = missing_sites(bed, ref, [chrom], c.maxDistance).filter(in_unit)
+    imputed = standard_dtypes(fast_impute(missing, c.maxDistance))
+    imputed = imputed.collect(streaming=c.streaming)
+
+    outfile = unit_file(manifest, unit)
+    tmp = outfile.with_suffix(f".tmp{socket.gethostname()}_{os.getpid()}")
+    imputed.write_parquet(tmp)
+    os.replace(tmp, outfile)  # the unit counts as done once its file exists
+    return imputed.height
+
+
+def pending_units(manifest):
+    """Units whose output does not exist yet."""
+    return [unit for unit in manifest["units"] if not unit_file(manifest, unit).exists()]
+
+
+def merge_units(manifest, output=None):
+    """Stitch each sample's units into its output, after checking that every unit is done.
+
+    Samples are recorded in the run manifest of the output directory, as in a whole run.
+    """
+    missing = pending_units(manifest)
+    if missing:
+        ids = ", ".join(unit["id"] for unit in missing[:10])
+        raise ValueError(f"{len(missing)} work unit(s) are not done: {ids}.")
+
+    c = Config(**manifest["config"])
+    output = output or c.output
+    Path(output).mkdir(parents=True, exist_ok=True)
+    pipeline = Pipeline(c)
+    beds = {}
+    files = {}
+    for unit in manifest["units"]:
+        beds[unit["sample"]] = unit["bed"]
+        files.setdefault(unit["sample"], []).append(unit_file(manifest, unit))
+
+    reference = reference_meta(manifest["reference_index"])["hash"]
+    run_manifest = RunManifest(output, reference, pipeline.params(), c.outputFormat)
+    run_manifest.pending(list(beds.values()))
+    for name, unit_files in files.items():
+        result = pl.scan_parquet(unit_files)  # units are listed in reference order
+        if c.outputSites == "imputed":
+            result = imputed_sites(result)
+        print(sink_files(result, name, output, c.outputFormat))
+        run_manifest.done(name)
+    return list(files)
+
+
+def build_cluster_parser():
+    """Command line options."""
+    parser = argparse.ArgumentParser(description="Split imputation into work units coordinated through files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan = commands.add_parser("plan", help="Write a shard manifest; options after -- are those of main.py")
+    plan.add_argument("manifest", help="Path of the shard manifest; units are written next to it")
+    plan.add_argument(
+        "--unitSites",
+        action="store",
+        type=int,
+        default=UNIT_SITES,
+        help=f"Reference sites per work unit. Default = {UNIT_SITES}",
+    )
+
+    run = commands.add_parser("run-shard", help="Impute one work unit")
+    run.add_argument("manifest", help="Path of the shard manifest")
+    run.add_argument("--unit", action="store", required=True, help="Position of the unit in the manifest, or its id")
+
+    merge = commands.add_parser("merge", help="Check that every unit is done and write the per-sample outputs")
+    merge.add_argument("manifest", help="Path of the shard manifest")
+    merge.add_argument("-o", "--output", action="store", required=False, help="Output directory. Default = as planned")
+    return parser
+
+
+def main(argv=None):
+    """Command line entry point."""
+    argv = sys.argv[1:] if argv is None else argv
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = build_cluster_parser().parse_args(argv[:split])
+
+    try:
+        if args.command == "plan":
+            run_args = build_parser().parse_args(argv[split + 1 :])
+            if not run_args.input:
+                raise ValueError("plan needs -i/--input.")
+            bed_paths = find_beds(run_args.input, run_args.pattern)
+            if not bed_paths:
+                raise ValueError("No matching Bed file(s) found.")
+            manifest = plan_units(Config.from_args(run_args), bed_paths, args.manifest, args.unitSites)
+            print(f"Planned {len(manifest['units'])} work unit(s) for {len(bed_paths)} sample(s) in {args.manifest}")
+        elif args.command == "run-shard":
+            manifest = load_manifest(args.manifest)
+            unit = find_unit(manifest, args.unit)
+            print(f"Imputed {run_unit(manifest, unit)} sites for {unit['id']}")
+        else:
+            manifest = load_manifest(args.manifest)
+            names = merge_units(manifest, args.output)
+            print(f"Merged {len(names)} sample(s)")
+    except ValueError as err:
+        print(f"ERROR: {err} GIMMEcpg terminating.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,125 @@
 """Input and output files."""
 
+import atexit
 import concurrent.futures
+import gzip
+import io
+import shutil
+import tempfile
+import threading
+import zlib
 from pathlib import Path
 
 import polars as pl
 
+from .missing import on_reference
+from .regions import in_regions
+from .report import REPORT
+from .sketch import counts_quantile, with_quantile
+
+BED_COLUMNS = {
+    "column_1": "chr",
+    "column_2": "start",
+    "column_3": "end",
+    "column_6": "strand",
+    "column_10": "coverage",
+    "column_11": "percent_methylated",
+}
+
+BED_DTYPES = {
+    "column_1": pl.Utf8,
+    "column_2": pl.UInt64,
+    "column_3": pl.UInt64,
+    "column_6": pl.Utf8,
+    "column_10": pl.UInt64,
+    "column_11": pl.UInt64,
+}
+
+COMPACT_BED_DTYPES = {
+    **BED_DTYPES,
+    "column_2": pl.UInt32,
+    "column_3": pl.UInt32,
+    "column_10": pl.UInt32,
+    "column_11": pl.UInt8,
+}
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+OUTPUT_SUFFIXES = {"tsv": ".bed", "parquet": ".parquet", "ipc": ".arrow"}
+
+RESULT_COLUMNS = ["chr", "start", "end", "strand", "sample", "avg"]
+
+OUTPUT_SCHEMA = {"chr": pl.Utf8, "start": pl.UInt64, "end": pl.UInt64, "avg": pl.Float64}
+
+ROW_GROUP_SIZE = 100_000  # small row groups keep chr/start statistics selective for range queries
+
 
 def collapse_strands(bed):
-    """Collapse strands."""
-    pos = bed.filter(pl.col("strand") == "+")
-    neg = bed.filter(pl.col("strand") == "-").with_columns(
-        (pl.col("start")).alias("cStart")
-    )  # add column for start site on complementary strand
-
-    joint = pos.join(neg, left_on=["chr", "end"], right_on=["chr", "cStart"], how="full", coalesce=True).with_columns(
-        pl.concat_str([pl.col("strand"), pl.col("strand_right")], separator="/", ignore_nulls=True)
-    )
+    """Collapse strands.
 
+    The ``-`` half of a CpG starts one base after its ``+`` half, so both halves are moved to the
+    ``+`` position and merged with a ``group_by``, which the streaming engine runs in chunks.
+    """
     merged = (
-        joint.with_columns(
-            pl.min_horizontal("start", "start_right").alias("start"),
-            pl.col(["percent_methylated_right", "coverage_right", "percent_methylated", "coverage"])
-            .fill_null(0)
-            .cast(pl.UInt64)
+        bed.filter(pl.col("strand").is_in(["+", "-"]))
+        .with_columns(
+            pl.when(pl.col("strand") == "-").then(pl.col("start") - 1).otherwise(pl.col("start")).alias("start"),
+            pl.col(["coverage", "percent_methylated"]).fill_null(0).cast(pl.UInt64),
         )
+        .with_columns((pl.col("coverage") * pl.col("percent_methylated")).alias("methylated"))
+        .group_by(["chr", "start"])
+        .agg(
+            pl.col("strand").first(),
+            pl.len().alias("halves"),
+            pl.col("coverage").sum().alias("total_coverage"),
+            pl.col("methylated").sum(),
+        )
+        .filter(pl.col("total_coverage") > 0)  # remove sites with no coverage
         .with_columns(
-            (pl.col("coverage") + pl.col("coverage_right")).alias("total_coverage"),
-            pl.when(pl.col("strand") == "-").then(pl.col("start") - 1).otherwise(pl.col("start")).alias("start")
+            pl.when(pl.col("halves") > 1).then(pl.lit("+/-")).otherwise(pl.col("strand")).alias("strand"),
+            (pl.col("methylated") / pl.col("total_coverage")).alias("avg"),  # weighted average
         )
-        .filter(pl.col("total_coverage") > 0) # remove sites with no coverage
+        .drop(["halves", "methylated"])
+    )
+
+    return merged
+
+
+def collapse_sorted(bed):
+    """Collapse strands of a bed file sorted by position in one linear pass over adjacent rows.
+
+    In sorted input the ``-`` half of a CpG directly follows its ``+`` half, one base later on the
+    same chromosome, so each pair is found by looking at the next row. Gives the same sites,
+    strands, coverages and averages as ``collapse_strands``, in input order; unsorted input leaves
+    pairs uncollapsed.
+    """
+
+    def after(col):
+        return pl.col(col).shift(-1)
+
+    paired = (
+        (pl.col("strand") == "+")
+        & (after("strand") == "-")
+        & (after("chr") == pl.col("chr"))
+        & (after("start") == pl.col("start") + 1)
+    ).fill_null(False)
+
+    return (
+        bed.filter(pl.col("strand").is_in(["+", "-"]))
+        .with_columns(pl.col(["coverage", "percent_methylated"]).fill_null(0).cast(pl.UInt64))
+        .with_columns(
+            paired.alias("paired"),
+            paired.shift().fill_null(False).alias("second_half"),  # "-" half already merged into the row before
+        )
+        .with_columns(
+            pl.when("paired").then(after("coverage")).otherwise(0).alias("coverage_right"),
+            pl.when("paired").then(after("percent_methylated")).otherwise(0).alias("percent_methylated_right"),
+            pl.when("paired").then(pl.lit("+/-")).otherwise(pl.col("strand")).alias("strand"),
+            pl.when(pl.col("strand") == "-").then(pl.col("start") - 1).otherwise(pl.col("start")).alias("start"),
+        )
+        .filter(~pl.col("second_half"))
+        .with_columns((pl.col("coverage") + pl.col("coverage_right")).alias("total_coverage"))
+        .filter(pl.col("total_coverage") > 0)  # remove sites with no coverage
         .with_columns(
             (
                 (
@@ -38,97 +129,430 @@ def collapse_strands(bed):
                 / pl.col("total_coverage")
             ).alias("avg")
         )  # calculated weighted average
+        .drop(["paired", "second_half"])
     )
 
-    return merged
 
+def collapse_chunks(frames):
+    """Collapse strands of consecutive chunks of a sorted bed file, one chunk at a time.
 
-def read_files(file, mincov, collapse):
-    """Scan files."""
-    name = Path(file).stem
-    print(f"Scanning {name}")
-    bed = (
-        pl.scan_csv(
-            file,
-            separator="\t",
-            skip_rows=1,
-            has_header=False,
-            dtypes={
-                "column_1": pl.Utf8,
-                "column_2": pl.UInt64,
-                "column_3": pl.UInt64,
-                "column_6": pl.Utf8,
-                "column_10": pl.UInt64,
-                "column_11": pl.UInt64,
-            },
-        )  # cannot use scan() on zipped file
-        .select(
-            ["column_1", "column_2", "column_3", "column_6", "column_10", "column_11"]
-        )  # only select relevant columns
-        .rename(
-            {
-                "column_1": "chr",
-                "column_2": "start",
-                "column_3": "end",
-                "column_6": "strand",
-                "column_10": "coverage",
-                "column_11": "percent_methylated",
-            }
-        )  # rename to something that makes more sense
+    A chunk ending on a ``+`` site holds it back for the next chunk, where its ``-`` half may start.
+    """
+    carry = None
+    for frame in frames:
+        if carry is not None:
+            frame = pl.concat([carry, frame])
+        carry = None
+        if frame.height and frame["strand"][-1] == "+":
+            frame, carry = frame.head(-1), frame.tail(1)
+        yield collapse_sorted(frame)
+    if carry is not None:
+        yield collapse_sorted(carry)
+
+
+def clean_bed(raw):
+    """Select and rename the bed columns used, with chromosome names matching the reference."""
+    return (
+        raw.select(list(BED_COLUMNS))  # only select relevant columns
+        .rename(BED_COLUMNS)  # rename to something that makes more sense
         .with_columns(
             pl.col("chr").str.replace_all(r"(?i)Chr", "")  # remove "chr" from Chr column to match reference
         )
     )
 
-    if collapse:
-        data = collapse_strands(bed)
-        data = data.with_columns(
-            maxQuant=pl.col("total_coverage").quantile(0.999, "nearest")
-        )  # calculate max coverage quantile
+
+def sample_name(file):
+    """Sample name from a (possibly gzipped) bed file path."""
+    path = Path(file)
+    if path.suffix == ".gz":
+        path = path.with_suffix("")
+    return path.stem
+
+
+def is_gzip(file):
+    """Check for a gzip header."""
+    with open(file, "rb") as fh:
+        return fh.read(2) == GZIP_MAGIC
+
+
+def is_bgzf(file):
+    """Check for a block-gzip (bgzip) header."""
+    with open(file, "rb") as fh:
+        header = fh.read(18)
+    return header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def bgzf_blocks(buf):
+    """Split raw bgzip bytes into whole blocks, returning the blocks and the unused tail."""
+    blocks = []
+    pos = 0
+    while pos + 18 <= len(buf):
+        bsize = int.from_bytes(buf[pos + 16 : pos + 18], "little") + 1  # BSIZE is total block size - 1
+        if pos + bsize > len(buf):
+            break
+        xlen = int.from_bytes(buf[pos + 10 : pos + 12], "little")
+        blocks.append(buf[pos + 12 + xlen : pos + bsize - 8])  # deflate payload between header and CRC/ISIZE
+        pos += bsize
+    return blocks, buf[pos:]
+
+
+def inflate_block(block):
+    """Decompress one raw deflate block."""
+    return zlib.decompress(block, -zlib.MAX_WBITS)
+
+
+def bgzf_chunks(file, chunk_size, threads):
+    """Decompress a bgzip file in parallel, one window of blocks at a time."""
+    with open(file, "rb") as fh, concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        tail = b""
+        while raw := fh.read(chunk_size):
+            blocks, tail = bgzf_blocks(tail + raw)
+            yield b"".join(executor.map(inflate_block, blocks))  # zlib releases the GIL
+        if tail:
+            raise ValueError(f"Truncated bgzip file: {file}")
+
+
+def gzip_chunks(file, chunk_size):
+    """Decompress a plain gzip file serially."""
+    with gzip.open(file, "rb") as fh:
+        while data := fh.read(chunk_size):
+            yield data
+
+
+def parse_bed_chunk(data, dtypes=BED_DTYPES):
+    """Parse complete bed lines into the columns used by read_files."""
+    return pl.read_csv(
+        io.BytesIO(data),
+        separator="\t",
+        has_header=False,
+        columns=list(BED_COLUMNS),
+        schema_overrides=dtypes,
+    )
+
+
+def gzip_frames(file, chunk_size=1 << 26, threads=None, dtypes=BED_DTYPES):
+    """Parsed frames of a gzip or bgzip bed file, one per decompressed window of whole lines."""
+    chunks = bgzf_chunks(file, chunk_size, threads) if is_bgzf(file) else gzip_chunks(file, chunk_size)
+
+    carry = b""
+    header = True
+    for data in chunks:
+        data = carry + data
+        cut = data.rfind(b"\n") + 1
+        data, carry = data[:cut], data[cut:]
+        if header:  # skip the header line, as scan_csv(skip_rows=1) does
+            newline = data.find(b"\n")
+            if newline < 0:
+                carry = data + carry
+                continue
+            data = data[newline + 1 :]
+            header = False
+        if data:
+            yield parse_bed_chunk(data, dtypes)
+    if carry.strip() and not header:
+        yield parse_bed_chunk(carry, dtypes)
+
+
+def spill(frames, schema, tmpdir=None):
+    """Write frames to parquet files in a new directory under ``tmpdir`` and scan them as one lazy frame.
+
+    Only one frame is in memory at a time, and the files last as long as ``tmpdir``, which the
+    caller removes once the scan has been collected (see ``Pipeline.save``). Without ``tmpdir``
+    the system temporary directory is used and the files are only removed when the process exits.
+    Without frames an empty frame of ``schema`` is returned.
+    """
+    spilldir = Path(tempfile.mkdtemp(prefix="gimmecpg_", dir=tmpdir))
+    if tmpdir is None:
+        atexit.register(shutil.rmtree, spilldir, ignore_errors=True)
+    tmpdir = spilldir
+
+    files = []
+    for i, frame in enumerate(frames):
+        files.append(Path(tmpdir, f"chunk_{i:05d}.parquet"))
+        frame.write_parquet(files[-1], compression="lz4")  # parquet scans, unlike IPC ones, can be sunk
+
+    if not files:
+        return pl.LazyFrame(schema=schema)
+    return pl.scan_parquet(files)
+
+
+def split_chromosomes(data, outdir):
+    """Write each chromosome of a frame to its own parquet file in ``outdir``; returns the files by chromosome."""
+    files = {}
+    for (chrom,), part in data.partition_by("chr", maintain_order=True, as_dict=True).items():
+        files[chrom] = Path(outdir, f"obs_chr_{chrom}.parquet")
+        part.write_parquet(files[chrom])
+    return files
+
+
+def spill_sites(chunks, mincov, schema, tmpdir=None):
+    """Spill the sites of each chunk with at least ``mincov`` total coverage (see ``spill``).
+
+    Returns the scan of the kept sites and the ``total_coverage`` value counts of all sites, from
+    which ``read_files`` takes the same coverage quantile as from the unfiltered sites.
+    """
+    counts = []
+
+    def kept():
+        for sites in chunks:
+            counts.append(sites.group_by("total_coverage").agg(pl.len().alias("count")))
+            yield sites.filter(pl.col("total_coverage") >= mincov)
+
+    data = spill(kept(), schema, tmpdir)
+    if not counts:
+        return data, pl.LazyFrame(schema={"total_coverage": schema["total_coverage"], "count": pl.UInt32})
+    return data, pl.concat(counts).group_by("total_coverage").agg(pl.col("count").sum()).lazy()
+
+
+def read_gzip(file, chunk_size=1 << 26, threads=None, dtypes=BED_DTYPES, tmpdir=None):
+    """Read a gzip or bgzip bed file without decompressing it to disk.
+
+    The file is decompressed in windows of ``chunk_size`` bytes (bgzip blocks in parallel) and
+    each window is parsed straight away, keeping only the selected columns, and spilled to a
+    parquet file under ``tmpdir`` (see ``spill``), so memory is bounded by the window size rather
+    than the file.
+    """
+    return spill(gzip_frames(file, chunk_size, threads, dtypes), {col: dtypes[col] for col in BED_COLUMNS}, tmpdir)
+
+
+def uncollapsed_sites(bed):
+    """Sites of a bed file without collapsing strands."""
+    return bed.with_columns(pl.col("percent_methylated").alias("avg"), pl.col("coverage").alias("total_coverage"))
+
+
+def gzip_sites(file, mincov, dtypes=BED_DTYPES, chunk_size=1 << 26, tmpdir=None):
+    """Uncollapsed sites of a gzip or bgzip bed file, coverage-filtered window by window (see ``spill_sites``)."""
+    empty = uncollapsed_sites(clean_bed(pl.DataFrame(schema={col: dtypes[col] for col in BED_COLUMNS})))
+    chunks = (uncollapsed_sites(clean_bed(frame)) for frame in gzip_frames(file, chunk_size, dtypes=dtypes))
+    return spill_sites(chunks, mincov, empty.schema, tmpdir)
+
+
+def collapse_gzip(file, mincov, dtypes=BED_DTYPES, chunk_size=1 << 26, tmpdir=None):
+    """Read and collapse a sorted gzip or bgzip bed file window by window (see ``collapse_chunks``).
+
+    Collapsed windows are coverage-filtered and spilled as they are read (see ``spill_sites``).
+    """
+    empty = collapse_sorted(clean_bed(pl.DataFrame(schema={col: dtypes[col] for col in BED_COLUMNS})))
+    chunks = collapse_chunks(clean_bed(frame) for frame in gzip_frames(file, chunk_size, dtypes=dtypes))
+    return spill_sites(chunks, mincov, empty.schema, tmpdir)
+
+
+def read_files(file, mincov, collapse, schema=None, approx=False, presorted=False, tmpdir=None):
+    """Scan files.
+
+    ``schema`` (see ``reference.compact_schema``) overrides the dtypes of the ``chr``, ``start`` and
+    ``avg`` columns, and the bed file is parsed with narrower integers; sites on chromosomes outside
+    the reference are dropped after the coverage quantile. ``approx`` estimates that quantile with
+    ``sketch.with_quantile`` so that it does not stop the query from streaming. ``presorted`` bed
+    files are collapsed with ``collapse_sorted`` (gzipped ones chunk by chunk as they are read).
+    Gzipped files are decompressed when this is called and spilled under ``tmpdir`` (see ``spill``),
+    so it is called just before the sample is collected; unless strands are joined across windows
+    (collapsed but not ``presorted``), the coverage filter runs on each window first and the
+    quantile is then exact from the coverage counts whatever ``approx`` is.
+    """
+    name = sample_name(file)
+    print(f"Scanning {name}")
+    dtypes = COMPACT_BED_DTYPES if schema else BED_DTYPES
+    counts = None
+    if collapse and presorted and is_gzip(file):
+        data, counts = collapse_gzip(
+            file, mincov, dtypes, tmpdir=tmpdir
+        )  # collapsed and coverage-filtered as it is decompressed
+    elif not collapse and is_gzip(file):
+        data, counts = gzip_sites(file, mincov, dtypes, tmpdir=tmpdir)  # coverage-filtered as it is decompressed
     else:
-        data = bed.with_columns(
-            pl.col("percent_methylated").alias("avg"),
-            pl.col("coverage").alias("total_coverage"),
-            maxQuant=pl.col("total_coverage").quantile(0.999, "nearest"),  # calculate max coverage quantile
-        )
+        if is_gzip(file):
+            raw = read_gzip(
+                file, dtypes=dtypes, tmpdir=tmpdir
+            )  # cannot use scan() on zipped file; strands pair across windows
+        else:
+            raw = pl.scan_csv(
+                file,
+                separator="\t",
+                skip_rows=1,
+                has_header=False,
+                schema_overrides=dtypes,
+            )
+        bed = clean_bed(raw)
+
+        if collapse and presorted:
+            data = collapse_sorted(bed)
+        elif collapse:
+            data = collapse_strands(bed)
+        else:
+            data = uncollapsed_sites(bed)
+
+    if counts is None:
+        data = with_quantile(data, "total_coverage", 0.999, "maxQuant", approx)  # calculate max coverage quantile
+    else:
+        data = data.join(counts_quantile(counts, "total_coverage", 0.999).rename({"quantile": "maxQuant"}), how="cross")
 
     quants = data.with_columns(
         over=pl.col("total_coverage") - pl.col("maxQuant")
     )  # identify rows that go over 99 quantile
 
+    out_dtypes = {"chr": pl.Utf8, "start": pl.UInt64, "avg": pl.Float64, "sample": pl.Utf8}
+    if schema:
+        quants = quants.filter(pl.col("chr").is_in(schema["chr"].categories))
+        out_dtypes.update({col: schema[col] for col in ("chr", "start", "avg")})
+
     data_cov_filt = (
         quants.filter((pl.col("total_coverage") >= mincov) & (pl.col("over") < 0))  # filter by coverage
         .with_columns(pl.lit(name).alias("sample"))
         .select(["chr", "start", "strand", "avg", "sample"])
-        .cast({"chr": pl.Utf8, "start": pl.UInt64, "avg": pl.Float64, "sample": pl.Utf8})
+        .cast(out_dtypes)
     )
 
     return data_cov_filt
 
 
-def save_files(df, outpath):
-    """Save files w/o streaming."""
-    filename = (
+def imputed_sites(lf):
+    """Only the imputed sites of a result, dropping those that repeat the input."""
+    return lf.filter(pl.col("sample") == "imputed")
+
+
+def merge_observed(imputed, observed, ref, chromosomes, regions=None):
+    """Full result from an imputed-only output and the sample's observed sites (see ``read_files``).
+
+    Observed sites are kept as the run kept them: only those at positions of the reference index
+    ``ref`` (see ``missing.missing_sites``) and, if the run had a region panel, inside the merged
+    ``regions`` (see ``regions.merge_regions``).
+    """
+    observed = on_reference(observed, ref, chromosomes)
+    if regions is not None:
+        observed = observed.filter(in_regions(regions, chromosomes))
+    observed = observed.with_columns((pl.col("start") + 1).alias("end")).select(RESULT_COLUMNS)
+    merged = pl.concat([imputed.select(RESULT_COLUMNS), observed], how="vertical_relaxed")
+    return standard_dtypes(merged).sort(["chr", "start"])
+
+
+def scan_output(outfile):
+    """Scan a saved result in any output format."""
+    suffix = Path(outfile).suffix
+    if suffix == OUTPUT_SUFFIXES["parquet"]:
+        return pl.scan_parquet(outfile)
+    if suffix == OUTPUT_SUFFIXES["ipc"]:
+        return pl.scan_ipc(outfile)
+    return pl.scan_csv(outfile, separator="\t", schema_overrides=OUTPUT_SCHEMA)
+
+
+def query_region(outfile, chrom, start, end):
+    """Sites of a saved result in ``[start, end)`` on ``chrom``.
+
+    Parquet outputs are sorted by chr/start in row groups of ``ROW_GROUP_SIZE`` with statistics, so
+    only the row groups overlapping the region are read; other formats are scanned in full.
+    """
+    return (
+        scan_output(outfile)
+        .filter(pl.col("chr") == str(chrom))
+        .filter(pl.col("start").is_between(start, end, closed="left"))
+        .collect()
+    )
+
+
+def standard_dtypes(lf):
+    """Cast a result back to the output dtypes (undoes ``reference.compact_schema``)."""
+    return lf.cast(OUTPUT_SCHEMA)
+
+
+def output_file(outpath, name, fmt):
+    """Output path for a sample."""
+    return Path(outpath, "imputed_" + name + OUTPUT_SUFFIXES[fmt])
+
+
+def write_frame(df, outfile, fmt):
+    """Write a collected result in the chosen format."""
+    if fmt == "parquet":
+        df.sort(["chr", "start"]).write_parquet(outfile, statistics=True, row_group_size=ROW_GROUP_SIZE)
+    elif fmt == "ipc":
+        df.write_ipc(outfile)
+    else:
+        df.write_csv(outfile, separator="\t")
+
+
+def save_files(df, outpath, fmt="tsv", name=None):
+    """Save files w/o streaming; ``name`` defaults to the sample of the observed sites."""
+    filename = name or (
         df.unique(subset="sample", keep="any")
         .select(pl.col("sample").filter(pl.col("sample") != "imputed").first())
         .item()
     )
-    outfile = Path(outpath, "imputed_" + filename + ".bed")
+    outfile = output_file(outpath, filename, fmt)
     print(f"Saving {filename}")
-    df.write_csv(outfile, separator="\t")
+    with REPORT.stage("save", sample=filename, rows_in=df.height):
+        write_frame(df, outfile, fmt)
     return f"Saved {filename}"
 
 
-def parallel_save(dfs, outpath):
-    """Save files in parallel."""
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(save_files, df, outpath): df for df in dfs}
+def sink_files(lf, name, outpath, fmt="tsv"):
+    """Save files by streaming the lazy result straight to disk.
+
+    The streaming engine cannot sink the as-of joins of ``missing.missing_sites`` or strand
+    collapsing; such results are collected in parts and spilled (see ``spill``) before being sunk.
+    """
+    outfile = output_file(outpath, name, fmt)
+    print(f"Saving {name}")
+    with REPORT.stage("sink", sample=name):
+        if fmt == "parquet":
+            lf.sort(["chr", "start"]).sink_parquet(outfile, statistics=True, row_group_size=ROW_GROUP_SIZE)
+        elif fmt == "ipc":
+            lf.sink_ipc(outfile)
+        else:
+            lf.sink_csv(outfile, separator="\t")
+    return f"Saved {name}"
+
+
+class Saver:
+    """Writes finished frames on a bounded pool of writer threads while later samples compute.
+
+    ``submit`` blocks once ``max_pending`` frames are waiting or being written, so finished
+    results cannot pile up in memory faster than they reach disk. A failed write is recorded
+    against its sample in ``errors`` and does not stop the others.
+    """
+
+    def __init__(self, outpath, fmt="tsv", workers=4, max_pending=None, on_saved=None):
+        """Start the writer pool."""
+        self.outpath = outpath
+        self.fmt = fmt
+        self.on_saved = on_saved
+        self.errors = {}
+        self.slots = threading.BoundedSemaphore(max_pending or workers)
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    def submit(self, name, df):
+        """Queue a sample's frame for writing, waiting for a free slot."""
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(save_files, df, self.outpath, self.fmt, name)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self.saved(name, future))
+
+    def saved(self, name, future):
+        """Report a finished write and free its slot."""
+        try:
+            print(future.result())
+            if self.on_saved:
+                self.on_saved(name)
+        except Exception as err:  # noqa: BLE001 - reported per sample
+            self.errors[name] = err
+            print(f"ERROR: saving {name} failed: {err}")
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Wait for all writes; returns the errors by sample."""
+        self.executor.shutdown(wait=True)
+        return self.errors
+
+    def __enter__(self):
+        """Use as a context manager that waits for all writes on exit."""
+        return self
 
-    for future in concurrent.futures.as_completed(futures):
-        df = futures[future]
-        result = future.result()
-        print(f"{result}")
-    return df
+    def __exit__(self, *exc):
+        """Wait for all writes."""
+        self.close()
 
 
 # def save_files_normal(file, outpath):
@@ -1,9 +1,20 @@
 """Imputation."""
 
+import tempfile
+import time
+from pathlib import Path
+
 import h2o
 import polars as pl
 from h2o.automl import H2OAutoML
 
+from .regressor import NumpyRegressor
+from .report import REPORT
+from .sketch import with_quantile
+
+PREDICTORS = ["lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"]
+SITE_KEY = ["chr", "start"]  # carried through the backends to join predictions back to their sites
+
 
 def fast_impute(lf, dist):
     """Fast imputation."""
@@ -54,8 +65,34 @@ def distBins(lf, col):
     return corrMat
 
 
-def h2oPrep(lf, dist, streaming):
-    """Prepare training and testing frames."""
+def sampleTraining(lf, n, seed=1):
+    """Draw about ``n`` training sites, stratified by neighbour distance bins.
+
+    Each (``f_dist_bins``, ``b_dist_bins``) stratum keeps its share of the sites, rounded up so that
+    rare bins stay represented; the few rows this adds beyond ``n`` are trimmed evenly across strata.
+    Sampling is a seeded shuffle, so the same input and seed give the same training set.
+    """
+    strata = ["f_dist_bins", "b_dist_bins"]
+
+    return (
+        lf.with_columns(
+            pl.int_range(pl.len()).shuffle(seed).over(strata).alias("rank"),
+            pl.len().over(strata).alias("stratum_size"),
+        )
+        .filter(pl.col("rank") < (pl.col("stratum_size") * n / pl.len()).ceil())
+        .sort((pl.col("rank") / pl.col("stratum_size")), *strata, "rank")
+        .head(n)
+        .drop(["rank", "stratum_size"])
+    )
+
+
+def h2oPrep(lf, dist, streaming, training=True, predict=True, trainRows=None, seed=1, approx=False):
+    """Prepare training and testing frames.
+
+    ``training=False`` or ``predict=False`` skip collecting the training features or the sites to
+    predict respectively, returning ``None`` in their place. ``trainRows`` caps the training set with
+    ``sampleTraining``. ``approx`` takes the error quantile from ``sketch.with_quantile``.
+    """
 
     known_sites = (
         lf.filter(pl.col("avg").is_not_null())
@@ -75,10 +112,9 @@ def h2oPrep(lf, dist, streaming):
         .with_columns(
             (pl.col("fast_res") - pl.col("avg")).abs().alias("error")
         )
-        .with_columns(
-            (pl.col("error").quantile(0.99, "nearest")).alias("limit") # 0.99 is the sweet spot?
-        )
-        .filter(pl.col("error") < pl.col("limit"))
+    )
+    known_sites = with_quantile(known_sites, "error", 0.99, "limit", approx).filter(  # 0.99 is the sweet spot?
+        pl.col("error") < pl.col("limit")
     )
 
 
@@ -101,7 +137,14 @@ def h2oPrep(lf, dist, streaming):
         known_sites
         .join(corr, right_on = "f_dist_bins", left_on = "b_dist_bins", how = "left").rename({"corr": "b_corr"})
         .join(corr, on = "f_dist_bins", how = "left").rename({"corr": "f_corr"})
-        .select(["avg", "b_meth", "f_meth", "b_dist", "f_dist", "b_corr", "f_corr"])
+    )
+
+    if trainRows:
+        features_lf = sampleTraining(features_lf, trainRows, seed)
+
+    features_lf = (
+        features_lf
+        .select([*SITE_KEY, "avg", "b_meth", "f_meth", "b_dist", "f_dist", "b_corr", "f_corr"])
         .with_columns(
             (pl.col("b_meth").log1p()).alias("lg_b_meth"),
             (pl.col("f_meth").log1p()).alias("lg_f_meth"),
@@ -127,51 +170,155 @@ def h2oPrep(lf, dist, streaming):
         )
     )
 
-    if streaming:
-        features = features_lf.collect(streaming=True)
-        to_predict = to_predict_lf.select(["avg", "lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"]).collect(streaming=True)
-    else:
-        features = features_lf.collect()
-        to_predict = to_predict_lf.select(["avg", "lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"]).collect()
+    with REPORT.stage("h2oPrep") as record:
+        features = features_lf.collect(streaming=streaming) if training else None
+        columns = [*SITE_KEY, "avg", *PREDICTORS]
+        to_predict = to_predict_lf.select(columns).collect(streaming=streaming) if predict else None
+        record["training_rows"] = features.height if training else None
+        record["rows_out"] = to_predict.height if predict else None
 
     return features, to_predict, to_predict_lf
 
 
-def h2oTraining(lf, maxTime, maxModels, dist, streaming):
-    """Do training."""
-    print("Starting H2O AutoML training")
+def h2oFrame(df, path):
+    """Hand a Polars frame to H2O as a parquet file it imports natively (no pandas copy)."""
+    with REPORT.stage("h2o_transfer_in", rows_in=df.height):
+        df.write_parquet(path)
+        return h2o.import_file(str(path))
+
 
-    training, test, to_predict_lf = h2oPrep(lf, dist, streaming)
+def h2oResult(frame, path, keys=None):
+    """Bring an H2O frame back as a Polars frame through a csv export.
 
-    h2o.init()
+    ``keys`` maps key columns to their Polars dtypes, which the csv export loses.
+    """
+    keys = keys or {}
+    with REPORT.stage("h2o_transfer_out") as record:
+        h2o.export_file(frame, str(path), force=True)
+        df = pl.read_csv(path, schema_overrides={col: pl.Utf8 if col == "chr" else pl.Float64 for col in keys})
+        df = df.cast(keys)
+        record["rows_out"] = df.height
+    return df
 
-    trainingFrame = h2o.H2OFrame(
-        training.to_pandas(use_pyarrow_extension_array=True)
-    )  # make sure it's the right format
-    trainingFrame[["avg", "lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"]] = trainingFrame[
-        ["avg", "lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"] 
-    ].asnumeric()
 
-    testingFrame = h2o.H2OFrame(test.to_pandas(use_pyarrow_extension_array=True))  # make sure it's the right format
-    testingFrame[["avg", "lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"]] = testingFrame[
-        ["avg", "lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"] 
-    ].asnumeric()
+def h2oTrain(training, maxTime, maxModels):
+    """Run AutoML; returns the leader model and what the run left in the cluster (the AutoML run and its frame)."""
+    with tempfile.TemporaryDirectory(prefix="gimmecpg_h2o_") as tmpdir:
+        trainingFrame = h2oFrame(training, Path(tmpdir, "training.parquet"))
 
     y = "avg"  # specify the response columns
-    x = ["lg_b_dist", "lg_f_dist", "lg_b_meth", "lg_f_meth", "b_corr", "f_corr"]  # specify the predictors 
+    x = PREDICTORS  # specify the predictors
 
-    aml = H2OAutoML(max_runtime_secs=maxTime, seed=1, max_models=maxModels, nfolds = 5, stopping_rounds = 3, sort_metric = "deviance") 
-    aml.train(y=y, x=x, training_frame=trainingFrame)  
+    aml = H2OAutoML(max_runtime_secs=maxTime, seed=1, max_models=maxModels, nfolds = 5, stopping_rounds = 3, sort_metric = "deviance")
+    aml.train(y=y, x=x, training_frame=trainingFrame)
     lb = aml.leaderboard
 
-    prediction = aml.leader.predict(testingFrame)
+    print(lb.head(rows=lb.nrows))
+
+    return aml.leader, [aml, trainingFrame]
+
+
+def h2oPredict(model, test):
+    """Score sites with an H2O model; the predictions keep the ``SITE_KEY`` of their sites."""
+    with tempfile.TemporaryDirectory(prefix="gimmecpg_h2o_") as tmpdir:
+        testingFrame = h2oFrame(test, Path(tmpdir, "testing.parquet"))
+        prediction = model.predict(testingFrame)
+        keyed = testingFrame[SITE_KEY].cbind(prediction)  # aligned row by row inside the cluster
+        prediction_df = h2oResult(keyed, Path(tmpdir, "prediction.csv"), test.select(SITE_KEY).schema)
+
+    h2o.remove([testingFrame, prediction, keyed])
+
+    return prediction_df
+
+
+class H2OBackend:
+    """H2O AutoML on a local H2O cluster."""
+
+    name = "h2o"
+
+    def __init__(self, maxTime, maxModels):
+        """Set AutoML limits."""
+        self.maxTime = maxTime
+        self.maxModels = maxModels
+        self.model = None
+        self.created = []
+
+    def start(self):
+        """Start (or connect to) the H2O cluster."""
+        h2o.init()
+
+    def train(self, training):
+        """Train on the prepared features."""
+        self.model, created = h2oTrain(training, self.maxTime, self.maxModels)
+        self.created.extend(created)
+
+    def predict(self, test):
+        """Return the ``SITE_KEY`` of each site with a ``predict`` column."""
+        return h2oPredict(self.model, test)
+
+    def save(self, outpath):
+        """Save the leader as a MOJO."""
+        return self.model.download_mojo(path=str(outpath))
+
+    def load(self, path):
+        """Load a MOJO."""
+        self.model = h2o.import_mojo(str(path))
+
+    def reset(self):
+        """Free the AutoML runs (with their models) and frames that ``train`` left in the cluster.
+
+        Only keys this backend created are removed, so a loaded MOJO or another backend's model survives.
+        """
+        if self.created:
+            h2o.remove(self.created)
+            self.created = []
+            self.model = None
+
+
+class NumpyBackend:
+    """In-process NumPy regression, no JVM needed."""
 
-    with h2o.utils.threading.local_context(polars_enabled=True, datatable_enabled=True):
-        prediction_df = prediction.as_data_frame()
+    name = "numpy"
 
-    prediction_lf = pl.LazyFrame(prediction_df)
+    def __init__(self, maxTime=None, maxModels=None):
+        """AutoML limits do not apply; the arguments keep the backends interchangeable."""
+        self.model = None
 
-    imputed_lf = pl.concat([to_predict_lf, prediction_lf], how="horizontal")
+    def start(self):
+        """Nothing to start."""
+
+    def features(self, df):
+        """Feature columns as NumPy views of the Arrow buffers (copied only where there are nulls)."""
+        return [df.get_column(col).to_numpy() for col in PREDICTORS]
+
+    def train(self, training):
+        """Train on the prepared features."""
+        self.model = NumpyRegressor().fit(self.features(training), training.get_column("avg").to_numpy())
+
+    def predict(self, test):
+        """Return the ``SITE_KEY`` of each site with a ``predict`` column."""
+        return test.select(SITE_KEY).with_columns(predict=pl.Series(self.model.predict(self.features(test))))
+
+    def save(self, outpath):
+        """Save the fitted parameters."""
+        path = Path(outpath, "gimmecpg_model.npz")
+        self.model.save(path)
+        return path
+
+    def load(self, path):
+        """Load fitted parameters."""
+        self.model = NumpyRegressor.load(path)
+
+    def reset(self):
+        """Nothing to free."""
+
+
+BACKENDS = {"h2o": H2OBackend, "numpy": NumpyBackend}
+
+
+def fillPredictions(lf, to_predict_lf, prediction_df, dist):
+    """Fill missing sites with the model's predictions."""
+    imputed_lf = to_predict_lf.join(prediction_df.lazy(), on=SITE_KEY, how="left")
 
     res = (
         lf.join(imputed_lf, on=["chr", "start"], how="full", coalesce=True)
@@ -185,9 +332,86 @@ def h2oTraining(lf, maxTime, maxModels, dist, streaming):
         res = res.filter((pl.col("f_dist") <= dist) & (pl.col("b_dist") <= dist))
 
     res = res.select(["chr", "start", "end", "strand", "sample", "avg"])
-    
-    print(lb.head(rows=lb.nrows))
 
-    h2o.remove_all()
+    return res
+
+
+def mlTraining(lf, backend, dist, streaming, trainRows=None, approx=False):
+    """Train a model for one sample and impute it."""
+    print(f"Starting {backend.name} training")
+
+    training, test, to_predict_lf = h2oPrep(lf, dist, streaming, trainRows=trainRows, approx=approx)
+
+    with REPORT.stage(f"{backend.name}_train", rows_in=training.height):
+        backend.train(training)
+
+    with REPORT.stage(f"{backend.name}_predict", rows_in=test.height):
+        prediction = backend.predict(test)
+
+    res = fillPredictions(lf, to_predict_lf, prediction, dist)
+
+    backend.reset()
 
     return res
+
+
+def pooledTraining(lfs, backend, dist, streaming, outpath, trainRows=None, approx=False):
+    """Train one model on known sites pooled from several samples and save it.
+
+    With ``trainRows`` each sample contributes an equal share of the training set.
+    """
+    print(f"Starting {backend.name} training on sites pooled from {len(lfs)} samples")
+
+    share = -(-trainRows // len(lfs)) if trainRows else None
+    training = pl.concat([h2oPrep(lf, dist, streaming, predict=False, trainRows=share, approx=approx)[0] for lf in lfs])
+
+    with REPORT.stage(f"{backend.name}_train", rows_in=training.height):
+        backend.train(training)
+
+    return backend.save(outpath)
+
+
+def mlScoring(lf, backend, dist, streaming, approx=False):
+    """Impute with an already trained model."""
+    _, test, to_predict_lf = h2oPrep(lf, dist, streaming, training=False, approx=approx)
+
+    with REPORT.stage(f"{backend.name}_predict", rows_in=test.height):
+        prediction = backend.predict(test)
+
+    return fillPredictions(lf, to_predict_lf, prediction, dist)
+
+
+def compareBackends(lf, backends, dist, streaming, trainRows=None, holdout=0.2, seed=1, approx=False):
+    """Train each backend on the same known sites and score a held-out share of them.
+
+    Returns one row per backend with training and prediction time (seconds) and the RMSE / MAE of the
+    predictions, clipped to 0-100 as in imputation.
+    """
+    training, _, _ = h2oPrep(lf, dist, streaming, predict=False, trainRows=trainRows, seed=seed, approx=approx)
+    training = training.with_columns(held_out=pl.int_range(pl.len()).shuffle(seed) < pl.len() * holdout)
+    train = training.filter(~pl.col("held_out"))
+    test = training.filter(pl.col("held_out"))
+
+    rows = []
+    for backend in backends:
+        backend.start()
+        start = time.perf_counter()
+        backend.train(train)
+        trained = time.perf_counter()
+        prediction = backend.predict(test)
+        predicted = time.perf_counter()
+
+        scored = test.join(prediction, on=SITE_KEY, how="left")
+        error = scored.get_column("predict").clip(0, 100) - scored.get_column("avg")
+        rows.append(
+            {
+                "backend": backend.name,
+                "train_s": trained - start,
+                "predict_s": predicted - trained,
+                "rmse": (error**2).mean() ** 0.5,
+                "mae": error.abs().mean(),
+            }
+        )
+        backend.reset()
+
+    return pl.DataFrame(rows)
@@ -2,197 +2,310 @@
 
 import argparse
 import glob
+import os
 import re
 import sys
-from itertools import batched
 
-import polars as pl
-from files import parallel_save, read_files
-from impute import fast_impute, h2oTraining
-from missing import missing_sites
+from .files import OUTPUT_SUFFIXES
+from .impute import BACKENDS
+from .pipeline import Config, Pipeline
+from .service import serve
 
 ##########################
 # Command line arguments #
 ##########################
 
-parser = argparse.ArgumentParser(description="Options for imputing missing CpG sites based on neighbouring sites")
-parser.add_argument(
-    "-i",
-    "--input",
-    action="store",
-    required=True,
-    help="Path to directory of bed files",
-)
-parser.add_argument("-p", "--pattern", action="store", required=False, help="Pattern to select specific files")
-parser.add_argument("-e", "--exclude", action="store", required=False, help="Path to a list of CpG sites to exclude")
-parser.add_argument("-o", "--output", action="store", required=True, help="Path to output directory")
-parser.add_argument("-r", "--ref", action="store", required=True, help="Path to reference methylation file")
-parser.add_argument(
-    "-c",
-    "--minCov",
-    action="store",
-    default=10,
-    required=False,
-    type=int,
-    help="Minimum coverage to consider methylation site as present. Default = 10",
-)
-parser.add_argument(
-    "-d",
-    "--maxDistance",
-    action="store",
-    default=1000,
-    required=False,
-    type=int,
-    help="Maximum distance between missing site and each neighbour for the site to be imputed. \
-                       Default = 1000bp",
-)
-parser.add_argument(
-    "-k",
-    "--collapse",
-    action="store_false",
-    required=False,
-    help="Choose whether to merge methylation sites on opposite \
-                       strands together. Default = True",
-)
-parser.add_argument(
-    "-x",
-    "--machineLearning",
-    action="store_true",
-    required=False,
-    help="Choose whether to use machine learning for imputation. Default = no machine learning",
-)
-parser.add_argument(
-    "-t",
-    "--runTime",
-    action="store",
-    default=3600,
-    required=False,
-    type=int,
-    help="Time (seconds) to train model. Default = 3600s (2h)",
-)
-parser.add_argument(
-    "-m",
-    "--maxModels",
-    action="store",
-    # default=5,
-    required=False,
-    type=int,
-    help="Maximum number of models to train within the time specified \
-                     under --runTime. Excludes Stacked Ensemble models",
-)
-parser.add_argument(
-    "-s",
-    "--streaming",
-    action="store_true",
-    required=False,
-    help="Choose if streaming is required (for files that exceed memory). Default = False",
-)
-args = parser.parse_args()
-
-
-##########################################################
-# Read file in as LazyFrame, collapse strands if needed. #
-##########################################################
-
-# select files
-bed_files = args.input + "/*.bed"
-bed_paths = glob.glob(bed_files)
-
-if args.pattern:
-    names = args.pattern.split(",")
-    regex = re.compile("|".join(names))
-    bed_paths = [path for path in bed_paths if regex.search(path)]
-
-
-# check files exist
-if not bed_paths:
-    print("ERROR: No matching Bed file(s) found. GIMMEcpg terminating.")
-    sys.exit(1)
-
-
-print(f"Merge methylation sites on opposite strands = {args.collapse}")
-print(f"Coverage cutoff at {args.minCov}")
-
-lf_list = [read_files(bed, args.minCov, args.collapse) for bed in bed_paths]
 
+def build_parser():
+    """Command line options."""
+    parser = argparse.ArgumentParser(description="Options for imputing missing CpG sites based on neighbouring sites")
+    parser.add_argument(
+        "-i",
+        "--input",
+        action="store",
+        required=False,
+        help="Path to directory of bed files (required unless --serve is given)",
+    )
+    parser.add_argument("-p", "--pattern", action="store", required=False, help="Pattern to select specific files")
+    parser.add_argument(
+        "-e", "--exclude", action="store", required=False, help="Path to a list of CpG sites to exclude"
+    )
+    parser.add_argument("-o", "--output", action="store", required=True, help="Path to output directory")
+    parser.add_argument("-r", "--ref", action="store", required=True, help="Path to reference methylation file")
+    parser.add_argument(
+        "--refIndex",
+        action="store",
+        required=False,
+        help="Directory to store the filtered reference index, reused across runs. \
+                           Default = directory of the reference file",
+    )
+    parser.add_argument(
+        "-c",
+        "--minCov",
+        action="store",
+        default=10,
+        required=False,
+        type=int,
+        help="Minimum coverage to consider methylation site as present. Default = 10",
+    )
+    parser.add_argument(
+        "-d",
+        "--maxDistance",
+        action="store",
+        default=1000,
+        required=False,
+        type=int,
+        help="Maximum distance between missing site and each neighbour for the site to be imputed. \
+                           Default = 1000bp",
+    )
+    parser.add_argument(
+        "-k",
+        "--collapse",
+        action="store_false",
+        required=False,
+        help="Choose whether to merge methylation sites on opposite \
+                           strands together. Default = True",
+    )
+    parser.add_argument(
+        "--sortedInput",
+        action="store_true",
+        required=False,
+        help="Bed files are sorted by chromosome and position: merge strands in one linear pass over adjacent \
+                           rows. Default = False",
+    )
+    parser.add_argument(
+        "-x",
+        "--machineLearning",
+        action="store_true",
+        required=False,
+        help="Choose whether to use machine learning for imputation. Default = no machine learning",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        action="store",
+        default="h2o",
+        required=False,
+        choices=list(BACKENDS),
+        help="Machine learning backend: H2O AutoML, or in-process NumPy regression that needs no Java. Default = h2o",
+    )
+    parser.add_argument(
+        "--compareBackends",
+        action="store_true",
+        required=False,
+        help="Before imputing, train every backend on the first sample and report runtime and held-out error \
+                           side by side",
+    )
+    parser.add_argument(
+        "-t",
+        "--runTime",
+        action="store",
+        default=3600,
+        required=False,
+        type=int,
+        help="Time (seconds) to train model. Default = 3600s (2h)",
+    )
+    parser.add_argument(
+        "-m",
+        "--maxModels",
+        action="store",
+        # default=5,
+        required=False,
+        type=int,
+        help="Maximum number of models to train within the time specified \
+                         under --runTime. Excludes Stacked Ensemble models",
+    )
+    parser.add_argument(
+        "--trainRows",
+        action="store",
+        required=False,
+        type=int,
+        help="Maximum number of known sites used for training, sampled evenly across neighbour distance bins. \
+                           Default = all sites",
+    )
+    parser.add_argument(
+        "--trainSamples",
+        action="store",
+        required=False,
+        type=int,
+        help="Train a single model on sites pooled from this many samples drawn at random, save it in the \
+                           output directory and use it for every sample. Default = one model per sample",
+    )
+    parser.add_argument(
+        "--model",
+        action="store",
+        required=False,
+        help="Path to a saved model (H2O MOJO or NumPy .npz, matching --backend) used to impute every sample \
+                           without training (implies --machineLearning)",
+    )
+    parser.add_argument(
+        "--shards",
+        action="store",
+        default=0,
+        required=False,
+        type=int,
+        help="Number of processes for imputing each (sample, chromosome) shard separately, so memory scales with \
+                           the largest chromosome. Default = 0 (off)",
+    )
+    parser.add_argument(
+        "-f",
+        "--outputFormat",
+        action="store",
+        default="tsv",
+        required=False,
+        choices=list(OUTPUT_SUFFIXES),
+        help="Output file format. Parquet output is sorted by chr/start with row group statistics. Default = tsv",
+    )
+    parser.add_argument(
+        "--outputSites",
+        action="store",
+        default="all",
+        required=False,
+        choices=["all", "imputed"],
+        help="Save every observed and imputed site, or only the imputed ones. Default = all",
+    )
+    parser.add_argument(
+        "--regions",
+        action="store",
+        required=False,
+        help="BED or parquet file of regions (chr, start, end); only sites inside them are imputed and saved",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        required=False,
+        help="Use compact dtypes (Enum chromosome, UInt32 positions, Float32 methylation) until output. \
+                           Default = False",
+    )
+    parser.add_argument(
+        "--approxQuantile",
+        action="store_true",
+        required=False,
+        help="Estimate the coverage and training error quantiles from a sketch (within 0.5%%) so they do not stop \
+                           --streaming. Default = False",
+    )
+    parser.add_argument(
+        "--inputCache",
+        action="store",
+        required=False,
+        help="Directory caching each bed file parsed and filtered as parquet; later runs with the same --minCov and \
+                           --collapse scan the cache instead of the bed file",
+    )
+    parser.add_argument(
+        "--memoryBudget",
+        action="store",
+        type=float,
+        required=False,
+        help="Memory (MB) that samples collected together may use; larger samples are streamed to disk one chromosome \
+            at a time. Default = half of RAM",
+    )
+    parser.add_argument(
+        "--maxConcurrent",
+        action="store",
+        type=int,
+        default=os.cpu_count(),
+        required=False,
+        help="Maximum number of samples collected together. Default = number of CPUs",
+    )
+    parser.add_argument(
+        "--writers",
+        action="store",
+        type=int,
+        default=4,
+        required=False,
+        help="Number of threads writing finished samples to disk while later samples compute. Default = 4",
+    )
+    parser.add_argument(
+        "--rerun",
+        action="store_true",
+        required=False,
+        help="Recompute every sample, even those whose outputs are recorded as up to date in the run manifest",
+    )
+    parser.add_argument(
+        "--report",
+        action="store",
+        required=False,
+        help="Path to a JSON report with wall time, memory and row counts for each sample and stage",
+    )
+    parser.add_argument(
+        "--reportPlans",
+        action="store_true",
+        required=False,
+        help="Include each sample's optimised Polars query plan in the --report JSON",
+    )
+    parser.add_argument(
+        "--dryRun",
+        "--explain",
+        action="store_true",
+        required=False,
+        help="Only print estimated rows, memory per stage, runtime and batches (or shards) for each sample that \
+                           is not up to date, with the optimised Polars plans, without imputing",
+    )
+    parser.add_argument(
+        "-s",
+        "--streaming",
+        action="store_true",
+        required=False,
+        help="Choose if streaming is required (for files that exceed memory). Default = False",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store",
+        type=int,
+        required=False,
+        help="Instead of imputing --input, serve imputation requests over HTTP on this local port, keeping the \
+                           reference index and model loaded between requests",
+    )
+    return parser
+
+
+def find_beds(input_dir, pattern=None):
+    """Bed files in a directory, optionally filtered by comma-separated patterns."""
+    bed_paths = glob.glob(input_dir + "/*.bed") + glob.glob(input_dir + "/*.bed.gz")  # gzip and bgzip are read directly
+
+    if pattern:
+        names = pattern.split(",")
+        regex = re.compile("|".join(names))
+        bed_paths = [path for path in bed_paths if regex.search(path)]
+
+    return bed_paths
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    pipeline = Pipeline(Config.from_args(args), keep_reference=args.serve is not None)
+
+    try:
+        if args.serve is not None:
+            pipeline.prepare()
+            serve(pipeline, port=args.serve)
+            return
+
+        if not args.input:
+            parser.error("the following arguments are required: -i/--input")
+
+        # check files exist
+        bed_paths = find_beds(args.input, args.pattern)
+        if not bed_paths:
+            print("ERROR: No matching Bed file(s) found. GIMMEcpg terminating.")
+            sys.exit(1)
+
+        if args.dryRun:
+            pipeline.explain(bed_paths)
+            return
+
+        summary = pipeline.run(bed_paths)
+    except ValueError as err:
+        print(f"ERROR: {err} GIMMEcpg terminating.")
+        sys.exit(1)
+
+    if summary["failed"]:
+        sys.exit(1)
+
+    print("Imputation complete")
 
-##########################
-# Identify missing sites #
-##########################
 
-if args.exclude: 
-    print("Blacklisted regions will be excluded")
-else:
-    print("No blacklisted regions provided; all autosomal CG sites considered")
-
-missing = [missing_sites(lf, args.ref, args.exclude) for lf in lf_list]
-
-print("Identified missing sites")
-
-################################
-# Imputation (default is fast) #
-################################
-
-if args.maxDistance > 0:
-    print(f"Imputing methylation for missing sites within {args.maxDistance} bases from each neighbour")
-
-results = []
-
-if not args.machineLearning:
-    print("Default imputation mode")
-    imputed_lfs = [fast_impute(lf, args.maxDistance) for lf in missing]  # RESULT
-    results = imputed_lfs
-else:
-    print("machineLearning mode: prepare for H2O AutoML training")
-    lead_prediction = [
-        h2oTraining(lf, args.runTime, args.maxModels, args.maxDistance, args.streaming) for lf in missing
-    ]  # RESULT
-    results = lead_prediction
-
-
-# if args.streaming:
-#         print("Collecting fast imputation results in streaming mode")
-#         dfs = pl.collect_all(results, streaming = True)
-#         for sample in dfs:
-#             save_files_streaming(sample, args.output)
-#         print("Files Saved")
-# else:
-#         print("Collecting fast imputation results")
-#         dfs = pl.collect_all(results)
-#         for sample in dfs:
-#             save_files_normal(sample, args.output)
-#         print("Files Saved")
-
-batch_limit = 10
-
-if len(results) <= batch_limit:
-    print("Batch mode OFF")
-    if args.streaming:
-        print("Collecting results in streaming mode")
-        dfs = pl.collect_all(results, streaming=True)
-        parallel_save(dfs, args.output)
-        print("All files Saved")
-    else:
-        print("Collecting results")
-        dfs = pl.collect_all(results)
-        parallel_save(dfs, args.output)
-        print("All files Saved")
-else:
-    print(f"Batches of {batch_limit}")
-    if args.streaming:
-        print("Collecting batches of results in streaming mode")
-        for batch in batched(results, batch_limit):
-            dfs = pl.collect_all(batch, streaming=True)
-            print("Saving in batches")
-            parallel_save(dfs, args.output)
-        print("All files Saved")
-    else:
-        print("Collecting batches of results")
-        for batch in batched(results, batch_limit):
-            dfs = pl.collect_all(batch)
-            print("Saving in batches")
-            parallel_save(dfs, args.output)
-        print("All files Saved")
-
-
-print("Imputation complete")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Run manifest for resumable, incremental cohort runs."""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from .files import output_file, sample_name
+
+MANIFEST_NAME = "gimmecpg_manifest.json"
+
+
+def fingerprint(path, sample_size=1 << 20):
+    """Cheap input fingerprint: size, modification time and a hash of the first and last MiB.
+
+    Hashing whole bed files would cost as much as reading them; size plus both ends catches
+    rewritten, truncated or appended files.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        digest.update(fh.read(sample_size))
+        if stat.st_size > sample_size:
+            fh.seek(max(sample_size, stat.st_size - sample_size))
+            digest.update(fh.read(sample_size))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+
+class RunManifest:
+    """Tracks which samples already have valid outputs for the current inputs and parameters.
+
+    The manifest lives in the output directory. A sample is skipped on rerun when its input
+    fingerprint, the reference fingerprint and the run parameters all match the recorded entry and
+    the recorded output file still exists with the recorded size.
+    """
+
+    def __init__(self, outpath, reference, params, fmt):
+        """Load the manifest in ``outpath``, if any."""
+        self.path = Path(outpath, MANIFEST_NAME)
+        self.outpath = outpath
+        self.reference = reference
+        self.params = params
+        self.fmt = fmt
+        self.inputs = {}
+        self.lock = threading.Lock()
+        self.samples = self.read()
+
+    def is_done(self, name, input_fp):
+        """Check whether a sample's recorded output is still valid."""
+        entry = self.samples.get(name)
+        if entry is None:
+            return False
+        outfile = output_file(self.outpath, name, self.fmt)
+        return (
+            entry["input"] == input_fp
+            and entry["reference"] == self.reference
+            and entry["params"] == self.params
+            and entry["output"] == outfile.name
+            and outfile.exists()
+            and outfile.stat().st_size == entry["output_size"]
+        )
+
+    def pending(self, bed_paths):
+        """Bed files whose outputs are missing or out of date."""
+        todo = []
+        for bed in bed_paths:
+            name = sample_name(bed)
+            self.inputs[name] = (str(bed), fingerprint(bed))
+            if not self.is_done(name, self.inputs[name][1]):
+                todo.append(bed)
+        return todo
+
+    def done(self, name):
+        """Record a sample whose output has been written."""
+        bed, input_fp = self.inputs[name]
+        outfile = output_file(self.outpath, name, self.fmt)
+        entry = {
+            "bed": bed,
+            "input": input_fp,
+            "reference": self.reference,
+            "params": self.params,
+            "output": outfile.name,
+            "output_size": outfile.stat().st_size,
+        }
+        with self.lock:
+            self.samples = {**self.read(), name: entry}  # keep samples recorded by other runs since loading
+            self.write()
+
+    def read(self):
+        """Samples recorded in the manifest on disk."""
+        return json.loads(self.path.read_text())["samples"] if self.path.exists() else {}
+
+    def write(self):
+        """Write the manifest atomically."""
+        tmp = self.path.with_suffix(f".tmp{os.getpid()}")
+        tmp.write_text(json.dumps({"samples": self.samples}, indent=2))
+        os.replace(tmp, self.path)
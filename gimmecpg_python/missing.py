@@ -3,48 +3,98 @@
 import polars as pl
 
 
-def missing_sites(bed, ref, blacklist):
-    """Compare to reference."""
-
-    if blacklist: 
-            
-        blacklist = (
-            pl.scan_parquet(blacklist, parallel="row_groups")
-            .cast({"chr": pl.Utf8, "start": pl.UInt64})
-            .select(["chr", "start"])
-        )
+def distances():
+    """Distance to each neighbour."""
+    return [
+        (pl.col("start") - pl.col("b_start")).alias("b_dist"),
+        (pl.col("f_start") - pl.col("start")).alias("f_dist"),
+    ]
 
-        ref = (
-            pl.scan_parquet(ref, parallel="row_groups")
-            .cast({"chr": pl.Utf8, "start": pl.UInt64, "end": pl.UInt64})
-            .select(["chr", "start", "end"])
-        ).filter(~pl.col("chr").is_in(["Y", "X"])).join(blacklist, how = "anti", on=["chr", "start"])
-    
-    else:
-
-        ref = (
-            pl.scan_parquet(ref, parallel="row_groups")
-            .cast({"chr": pl.Utf8, "start": pl.UInt64, "end": pl.UInt64})
-            .select(["chr", "start", "end"])
-        ).filter(~pl.col("chr").is_in(["Y", "X"]))
-
-
-    missing = ref.join(bed, on=["chr", "start"], how="left")
-
-    missing_mat = (
-        missing.with_columns(
-            pl.when(pl.col("avg").is_not_null()).then(pl.col("start")).alias("b_start"),
-            pl.when(pl.col("avg").is_not_null()).then(pl.col("start")).alias("f_start"),
-            pl.when(pl.col("avg").is_not_null()).then(pl.col("avg")).alias("b_meth"),
-            pl.when(pl.col("avg").is_not_null()).then(pl.col("avg")).alias("f_meth"),
-        )
-        .with_columns(
-            pl.col(["f_start", "f_meth"]).backward_fill().over("chr"),
-            pl.col(["b_start", "b_meth"]).forward_fill().over("chr"),
-        )
-        .with_columns(
-            (pl.col("start") - pl.col("b_start")).alias("b_dist"), (pl.col("f_start") - pl.col("start")).alias("f_dist")
-        )
+
+def site_key(chromosomes, col="start"):
+    """One sortable integer per site: chromosome rank (in reference order) above the position.
+
+    Sites on chromosomes outside ``chromosomes`` get a null key.
+    """
+    rank = pl.col("chr").replace_strict(chromosomes, range(len(chromosomes)), default=None, return_dtype=pl.UInt64)
+    return (rank * 2**32 + pl.col(col)).alias("key")
+
+
+def nearest(sites, observed, prefix, strategy, dist=0):
+    """As-of join of each site to the nearest observed site before (``backward``) or after it.
+
+    Both sides must be sorted by ``key``. A neighbour on another chromosome, or further than
+    ``dist`` bases away when ``dist`` > 0, is left null.
+    """
+    found = sites.join_asof(
+        observed.select(
+            pl.col("key").alias(f"{prefix}_key"),
+            pl.col("start").alias(f"{prefix}_start"),
+            pl.col("avg").alias(f"{prefix}_meth"),
+            pl.col("strand").alias(f"{prefix}_strand"),
+            pl.col("sample").alias(f"{prefix}_sample"),
+        ),
+        left_on="key",
+        right_on=f"{prefix}_key",
+        strategy=strategy,
+        tolerance=dist if dist > 0 else None,
     )
+    same_chr = pl.col(f"{prefix}_key") // 2**32 == pl.col("key") // 2**32
+    return found.with_columns(
+        pl.when(same_chr).then(pl.col(f"{prefix}_start")).alias(f"{prefix}_start"),
+        pl.when(same_chr).then(pl.col(f"{prefix}_meth")).alias(f"{prefix}_meth"),
+    )
+
+
+def align(sites, observed, dist=0):
+    """Observed value and nearest observed neighbours of each site, as ``missing_sites`` returns them.
+
+    Both sides carry a ``site_key`` and are sorted by it.
+    """
+    missing = nearest(sites, observed, "b", "backward", dist)
+    missing = nearest(missing, observed, "f", "forward", dist)
+
+    here = pl.col("b_key") == pl.col("key")  # the backward search finds the site itself if observed
+    missing = missing.with_columns(
+        pl.when(here).then(pl.col("b_strand")).alias("strand"),
+        pl.when(here).then(pl.col("b_meth")).alias("avg"),
+        pl.when(here).then(pl.col("b_sample")).alias("sample"),
+    )
+    if dist > 0:
+        missing = missing.filter(
+            pl.col("avg").is_not_null() | (pl.col("b_start").is_not_null() & pl.col("f_start").is_not_null())
+        )
+
+    return missing.select(
+        "chr",
+        "start",
+        "end",
+        "strand",
+        "avg",
+        "sample",
+        "b_start",
+        "f_start",
+        "b_meth",
+        "f_meth",
+    ).with_columns(distances())
+
+
+def on_reference(bed, ref, chromosomes):
+    """Observed sites at reference positions, with their site key (see ``missing_sites``)."""
+    sites = ref.select(site_key(chromosomes))
+    return bed.with_columns(site_key(chromosomes)).join(sites, on="key", how="semi")
+
+
+def missing_sites(bed, ref, chromosomes, dist=0):
+    """Compare to reference.
 
-    return missing_mat
+    ``ref`` is a scan of the reference index (see ``reference.scan_reference``), which is already
+    restricted to autosomes, has the blacklist removed and is sorted within each chromosome;
+    ``chromosomes`` are the chromosomes it scans, in reference order (``reference_meta(index)``).
+    Neighbours are found with as-of joins against the observed sites at reference positions, sorted
+    the same way, so blacklisted or off-reference observations never flank a site; with ``dist`` > 0
+    the search stops ``dist`` bases away and missing sites without an observed neighbour in range on
+    both sides are dropped.
+    """
+    sites = ref.with_columns(site_key(chromosomes))
+    return align(sites, on_reference(bed, ref, chromosomes).sort("key"), dist)
@@ -0,0 +1,460 @@
+"""Importable imputation pipeline."""
+
+import os
+import random
+import tempfile
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+
+import polars as pl
+
+from .cache import scan_input
+from .files import Saver, imputed_sites, sample_name, sink_files, spill, split_chromosomes, standard_dtypes
+from .impute import BACKENDS, compareBackends, fast_impute, mlScoring, mlTraining, pooledTraining
+from .manifest import RunManifest
+from .missing import missing_sites
+from .planner import plan_run, print_plan, query_plans
+from .reference import build_reference, compact_dtypes, file_hash, reference_meta, scan_reference
+from .regions import in_regions, merge_regions, read_regions
+from .report import REPORT
+from .scheduler import available_memory_mb, estimate_memory_mb, plan_batches
+from .shard import run_sharded
+
+
+def training_samples(bed_paths, n, seed=1):
+    """Bed files of ``n`` samples drawn at random to train one pooled model.
+
+    The draw is seeded and made from the sorted paths, so it does not depend on the order they are given in.
+    """
+    bed_paths = sorted(bed_paths, key=str)
+    return sorted(random.Random(seed).sample(bed_paths, min(n, len(bed_paths))), key=str)
+
+
+@dataclass
+class Config:
+    """Run options. Field names and defaults match the command line flags (see ``main.py``)."""
+
+    ref: str
+    output: str
+    exclude: str | None = None
+    refIndex: str | None = None
+    minCov: int = 10
+    maxDistance: int = 1000
+    collapse: bool = True
+    machineLearning: bool = False
+    backend: str = "h2o"
+    compareBackends: bool = False
+    runTime: int = 3600
+    maxModels: int | None = None
+    trainRows: int | None = None
+    trainSamples: int | None = None
+    model: str | None = None
+    shards: int = 0
+    outputFormat: str = "tsv"
+    outputSites: str = "all"
+    regions: str | None = None
+    compact: bool = False
+    approxQuantile: bool = False
+    inputCache: str | None = None
+    sortedInput: bool = False
+    memoryBudget: float | None = None
+    maxConcurrent: int = os.cpu_count()
+    writers: int = 4
+    rerun: bool = False
+    report: str | None = None
+    reportPlans: bool = False
+    dryRun: bool = False
+    streaming: bool = False
+
+    @classmethod
+    def from_args(cls, args):
+        """Config from parsed command line arguments (extra arguments are ignored)."""
+        return cls(**{field.name: getattr(args, field.name) for field in fields(cls)})
+
+    @property
+    def ml(self):
+        """Whether machine learning imputation is used."""
+        return self.machineLearning or bool(self.model)
+
+
+class Pipeline:
+    """Imputes bed files against one reference.
+
+    The reference index, region panel and machine learning backend (with its H2O cluster and any
+    loaded or pooled model) are set up once by ``prepare`` and reused by every ``run``, so a
+    long-lived pipeline (see ``service.py``) only pays for the samples themselves.
+
+    Example:
+        >>> pipeline = Pipeline(Config(ref="ref.parquet", output="out", maxDistance=500))
+        >>> pipeline.run(["sample1.bed", "sample2.bed.gz"])  # doctest: +SKIP
+    """
+
+    def __init__(self, config, keep_reference=False):
+        """Store the config; ``keep_reference`` holds the reference in memory between runs."""
+        self.config = config
+        self.keep_reference = keep_reference
+        self.ref_index = None
+        self.ref = None
+        self.schema = None
+        self.panel = None
+        self.flanked = None
+        self.chromosomes = None
+        self.backend = None
+        self.trained = False
+        self.compared = False
+
+    def prepare(self):
+        """Build or reuse the reference index and start the backend; later calls do nothing."""
+        if self.ref_index is not None:
+            return
+        c = self.config
+        self.validate()
+
+        print(f"Merge methylation sites on opposite strands = {c.collapse}")
+        print(f"Coverage cutoff at {c.minCov}")
+
+        if c.exclude:
+            print("Blacklisted regions will be excluded")
+        else:
+            print("No blacklisted regions provided; all autosomal CG sites considered")
+
+        with REPORT.stage("reference_index"):
+            self.ref_index = build_reference(c.ref, c.exclude, c.refIndex or Path(c.ref).parent)
+
+        self.load_reference(self.ref_index)
+        if self.keep_reference:
+            self.ref = self.ref.collect().lazy()
+
+        if c.ml:
+            self.backend = BACKENDS[c.backend](c.runTime, c.maxModels)
+            self.backend.start()  # one H2O cluster for the whole run
+            if c.model:
+                print(f"machineLearning mode: imputing with saved model {c.model}")
+                self.backend.load(c.model)
+                self.trained = True
+
+    def validate(self):
+        """Reject option combinations the pipeline cannot run."""
+        c = self.config
+        if c.shards > 0 and (c.ml or c.regions):
+            raise ValueError("--shards only supports genome-wide default imputation.")
+
+    def load_reference(self, index):
+        """Scan the reference index and read the regions, if any.
+
+        Without an ``index`` (a dry run before the index is built) the reference file itself is
+        scanned, before the sex chromosomes and blacklist are removed.
+        """
+        c = self.config
+        if index:
+            self.chromosomes = list(reference_meta(index)["chromosomes"])
+        else:
+            raw = pl.scan_parquet(c.ref).select(pl.col("chr").cast(pl.Utf8).unique(maintain_order=True))
+            self.chromosomes = raw.collect().to_series().to_list()
+        self.schema = compact_dtypes(self.chromosomes) if c.compact else None
+
+        if c.regions:
+            panel = read_regions(c.regions)
+            print(f"Restricting imputation to {panel.height} regions")
+            self.panel = merge_regions(panel)
+            # neighbours of a site in a region lie within maxDistance of it; without a limit, anywhere on its chromosome
+            self.flanked = merge_regions(panel, c.maxDistance or None)
+
+        if index:
+            self.ref = scan_reference(index, schema=self.schema, regions=self.flanked)
+        else:
+            ref = pl.scan_parquet(c.ref).select(["chr", "start", "end"])
+            ref = ref.cast({"chr": pl.Utf8, "start": pl.UInt64, "end": pl.UInt64})
+            if self.flanked is not None:
+                ref = ref.filter(in_regions(self.flanked, self.chromosomes))
+            if self.schema:
+                ref = ref.cast({col: self.schema[col] for col in ("chr", "start", "end")})
+            self.ref = ref
+
+    def params(self):
+        """Parameters that decide a sample's output, as recorded in the run manifest."""
+        c = self.config
+        params = {
+            "minCov": c.minCov,
+            "maxDistance": c.maxDistance,
+            "collapse": c.collapse,
+            "mode": c.backend if c.ml else "fast",
+        }
+        if c.ml:
+            params.update(
+                model=c.model,
+                trainSamples=c.trainSamples,
+                trainRows=c.trainRows,
+                runTime=c.runTime,
+                maxModels=c.maxModels,
+            )
+        if c.compact:
+            params["compact"] = True
+        if c.approxQuantile:
+            params["approxQuantile"] = True
+        if c.outputSites != "all":
+            params["outputSites"] = c.outputSites
+        if c.regions:
+            params["regions"] = file_hash(c.regions)
+        return params
+
+    def observed(self, bed_paths, tmpdir=None):
+        """Lazy observed sites of each bed file, around the regions if any.
+
+        Gzipped inputs are decompressed now and spilled under ``tmpdir`` (see ``files.read_files``).
+        """
+        c = self.config
+        lf_list = [
+            scan_input(bed, c.minCov, c.collapse, self.schema, c.approxQuantile, c.inputCache, c.sortedInput, tmpdir)
+            for bed in bed_paths
+        ]
+        if self.flanked is not None:
+            lf_list = [lf.filter(in_regions(self.flanked, self.chromosomes)) for lf in lf_list]
+        return lf_list
+
+    def impute(self, bed_paths, output, training_beds=None, explain=False, tmpdir=None):
+        """Lazy imputed results for each sample, by name, with spilled inputs under ``tmpdir``.
+
+        A pooled model (``trainSamples``) is trained on samples chosen from ``training_beds``
+        (default ``bed_paths``), so a resumed run trains on the same samples as the first one.
+        With ``explain`` no model is trained or used: machine learning results stop at the missing
+        sites, so their plans can be shown without the backend.
+        """
+        c = self.config
+        names = [sample_name(bed) for bed in bed_paths]
+        observed = self.observed(bed_paths, tmpdir)
+        missing = [missing_sites(lf, self.ref, self.chromosomes, c.maxDistance) for lf in observed]
+
+        print("Identified missing sites")
+
+        if c.maxDistance > 0:
+            print(f"Imputing methylation for missing sites within {c.maxDistance} bases from each neighbour")
+
+        if not c.ml:
+            print("Default imputation mode")
+
+        results = self.finish(names, missing, output, training_beds or bed_paths, explain, tmpdir)
+        for name, result in zip(names, results, strict=True):
+            REPORT.plan(name, result)
+
+        return dict(zip(names, results, strict=True))
+
+    def finish(self, names, missing, output, training_beds, explain=False, tmpdir=None):
+        """Impute the missing sites of each sample and shape the results for output."""
+        c = self.config
+        if not c.ml:
+            results = [fast_impute(lf, c.maxDistance) for lf in missing]
+        elif explain:
+            results = missing
+        else:
+            results = self.predict(names, missing, output, training_beds, tmpdir)
+
+        if self.panel is not None:
+            results = [lf.filter(in_regions(self.panel, self.chromosomes)) for lf in results]
+
+        if c.outputSites == "imputed":
+            results = [imputed_sites(lf) for lf in results]
+
+        if c.compact:
+            results = [standard_dtypes(lf) for lf in results]
+
+        return results
+
+    def stream(self, bed, output, training_beds, tmpdir):
+        """Impute one sample a chromosome at a time and stream it to disk.
+
+        The streaming engine cannot sink the as-of joins of ``missing_sites``, so the sample's
+        observed sites are read once and split by chromosome into ``tmpdir`` (as
+        ``shard.split_sample`` does), each chromosome is imputed against its part of the reference
+        and spilled, and the spilled parts are sunk. Machine learning trains and scores on the
+        whole sample, so its result is collected at once.
+        """
+        c = self.config
+        name = sample_name(bed)
+        with REPORT.stage("split_observed", sample=name) as record:
+            observed = self.observed([bed], tmpdir)[0].collect(streaming=True)
+            record["rows_out"] = observed.height
+        files = split_chromosomes(observed, tmpdir)
+        empty = pl.LazyFrame(schema=observed.schema)
+        del observed
+
+        def observed_sites(chromosomes):
+            parts = [files[chrom] for chrom in chromosomes if chrom in files]
+            return pl.scan_parquet(parts) if parts else empty
+
+        if c.ml:
+            missing = [missing_sites(observed_sites(self.chromosomes), self.ref, self.chromosomes, c.maxDistance)]
+        else:
+            missing = [
+                missing_sites(
+                    observed_sites([chrom]), self.ref.filter(pl.col("chr") == chrom), self.chromosomes, c.maxDistance
+                )
+                for chrom in self.chromosomes
+            ]
+        results = self.finish([name] * len(missing), missing, output, training_beds, tmpdir=tmpdir)
+
+        data = spill((lf.collect(streaming=True) for lf in results), results[0].collect_schema(), tmpdir)
+        return sink_files(data, name, output, c.outputFormat)
+
+    def predict(self, names, missing, output, training_beds, tmpdir=None):
+        """Machine learning imputation with the warm backend."""
+        c = self.config
+        if c.compareBackends and not self.compared:
+            print("Comparing machine learning backends on the first sample")
+            self.compared = True
+            backends = [BACKENDS[name](c.runTime, c.maxModels) for name in BACKENDS]
+            with REPORT.sample(names[0]):
+                comparison = compareBackends(
+                    missing[0], backends, c.maxDistance, c.streaming, c.trainRows, approx=c.approxQuantile
+                )
+                print(comparison)
+
+        if not (self.trained or c.trainSamples):
+            print(f"machineLearning mode: prepare for {c.backend} training")
+            results = []
+            for name, lf in zip(names, missing, strict=True):
+                with REPORT.sample(name):
+                    results.append(
+                        mlTraining(lf, self.backend, c.maxDistance, c.streaming, c.trainRows, c.approxQuantile)
+                    )
+            return results
+
+        if not self.trained:
+            print("machineLearning mode: training one model for all samples")
+            training = [
+                missing_sites(lf, self.ref, self.chromosomes, c.maxDistance)
+                for lf in self.observed(training_samples(training_beds, c.trainSamples), tmpdir)
+            ]
+            saved = pooledTraining(
+                training,
+                self.backend,
+                c.maxDistance,
+                c.streaming,
+                output,
+                c.trainRows,
+                c.approxQuantile,
+            )
+            print(f"Model saved to {saved}")
+            self.trained = True
+
+        results = []
+        for name, lf in zip(names, missing, strict=True):
+            with REPORT.sample(name):
+                results.append(mlScoring(lf, self.backend, c.maxDistance, c.streaming, c.approxQuantile))
+        return results
+
+    def save(self, bed_paths, output, manifest, training_beds, tmpdir=None):
+        """Impute and write samples under the memory budget; returns the samples that failed.
+
+        Samples that fit the budget are collected in batches, the others are streamed (see
+        ``stream``). Each batch or streamed sample is only read when its turn comes, with its
+        spilled files in a temporary directory under ``tmpdir`` removed once it is collected.
+        """
+        c = self.config
+        beds = {sample_name(bed): bed for bed in bed_paths}
+        if c.streaming:
+            batches, oversized = [], list(beds)
+        else:
+            ref_rows = self.ref.select(pl.len()).collect().item()
+            estimates = {name: estimate_memory_mb(bed, ref_rows, c.compact) for name, bed in beds.items()}
+            budget = c.memoryBudget or (available_memory_mb() or 8192) / 2
+            batches, oversized = plan_batches(list(beds), estimates, budget, c.maxConcurrent)
+            print(f"Memory budget {budget:.0f} MB: {len(batches)} batch(es), {len(oversized)} sample(s) streamed")
+
+        if oversized:
+            print("Streaming results to disk")
+            for name in oversized:
+                with tempfile.TemporaryDirectory(dir=tmpdir) as sample_dir:
+                    print(self.stream(beds[name], output, training_beds, sample_dir))
+                manifest.done(name)
+
+        # each batch is written while the next one computes; at most one frame per writer waits to be written
+        with Saver(output, c.outputFormat, c.writers, on_saved=manifest.done) as saver:
+            for batch_names in batches:
+                print(f"Collecting batch of {len(batch_names)}")
+                with tempfile.TemporaryDirectory(dir=tmpdir) as batch_dir:
+                    results = self.impute([beds[name] for name in batch_names], output, training_beds, tmpdir=batch_dir)
+                    with REPORT.stage("collect") as record:
+                        record["samples"] = batch_names
+                        record["estimated_mb"] = sum(estimates[name] for name in batch_names)
+                        dfs = pl.collect_all(list(results.values()))
+                        record["rows_out"] = [df.height for df in dfs]
+                for name, df in zip(batch_names, dfs, strict=True):
+                    saver.submit(name, df)
+                del dfs
+
+        return saver.errors
+
+    def explain(self, bed_paths):
+        """Print estimated rows, memory, runtime and batches with the query plans, without imputing.
+
+        Samples the run manifest records as up to date are left out, as ``run`` would skip them.
+        """
+        self.validate()
+        plan = plan_run(self.config, bed_paths, self.params())
+        self.load_reference(plan["reference_index"])
+        pending = [bed for bed in bed_paths if sample_name(bed) in plan["samples"]]
+        print_plan(plan, query_plans(self, pending))
+        return plan
+
+    def run(self, bed_paths, output=None):
+        """Impute and save bed files, skipping those with up-to-date outputs unless ``rerun`` is set.
+
+        Returns:
+            dict with the ``saved`` and ``skipped`` sample names and ``failed`` writes by sample.
+        """
+        c = self.config
+        output = output or c.output
+        REPORT.include_plans = c.reportPlans
+        self.prepare()
+
+        manifest = RunManifest(output, reference_meta(self.ref_index)["hash"], self.params(), c.outputFormat)
+        all_beds = bed_paths
+        pending = manifest.pending(bed_paths)
+        skipped = [] if c.rerun else [sample_name(bed) for bed in bed_paths if bed not in pending]
+        if not c.rerun:
+            if skipped:
+                print(f"Skipping {len(skipped)} sample(s) with up-to-date outputs")
+            bed_paths = pending
+
+        if not bed_paths:
+            print("All samples are up to date")
+            return {"saved": [], "skipped": skipped, "failed": {}}
+
+        names = [sample_name(bed) for bed in bed_paths]
+        self.compared = False
+        if c.shards > 0:
+            print(f"Sharded mode: imputing each chromosome separately across {c.shards} processes")
+            run_sharded(
+                bed_paths,
+                self.ref_index,
+                c.minCov,
+                c.collapse,
+                c.maxDistance,
+                c.streaming,
+                c.shards,
+                output,
+                c.outputFormat,
+                manifest,
+                self.schema,
+                c.approxQuantile,
+                c.inputCache,
+                c.sortedInput,
+                c.outputSites == "imputed",
+            )
+            failed = {}
+        else:
+            # everything a run spills lives here, so nothing outlives it in a long-lived service
+            with tempfile.TemporaryDirectory(prefix="gimmecpg_") as tmpdir:
+                failed = self.save(bed_paths, output, manifest, all_beds, tmpdir)
+
+        if failed:
+            print(f"ERROR: {len(failed)} sample(s) could not be saved: {', '.join(failed)}")
+        else:
+            print("All files Saved")
+
+        if c.report:
+            REPORT.write(c.report, asdict(c))
+            print(f"Run report written to {c.report}")
+
+        return {"saved": [name for name in names if name not in failed], "skipped": skipped, "failed": failed}
@@ -0,0 +1,213 @@
+"""Dry-run estimates of a run's size, memory, runtime and batches."""
+
+import gzip
+import io
+from pathlib import Path
+
+import polars as pl
+
+from .cache import cache_file
+from .files import BED_COLUMNS, clean_bed, collapse_strands, is_gzip, sample_name
+from .manifest import RunManifest
+from .reference import find_reference, reference_meta
+from .scheduler import (
+    COMPACT_FACTOR,
+    INPUT_ROW_BYTES,
+    REF_ROW_BYTES,
+    available_memory_mb,
+    estimate_rows,
+    plan_batches,
+)
+
+# Measured like the constants in scheduler.py, on data from synthetic.py and one core.
+OBSERVED_ROW_BYTES = 60  # read_files output: chr, start, strand, avg, sample
+FEATURE_ROW_BYTES = 150  # h2oPrep training features and sites to predict
+ROWS_PER_SECOND = 1_000_000  # fast imputation, input plus reference rows
+
+
+def sample_head(file, sample_size=1 << 20):
+    """Whole lines from the first MiB of a bed file (decompressed for gzip), without the header."""
+    if is_gzip(file):
+        with gzip.open(file, "rb") as fh:
+            head = fh.read(sample_size)
+    else:
+        with open(file, "rb") as fh:
+            head = fh.read(sample_size)
+    head = head[: head.rfind(b"\n") + 1]
+    return head[head.find(b"\n") + 1 :]
+
+
+def observed_share(file, mincov, collapse):
+    """Share of a bed file's rows kept as observed sites, from the lines in its first MiB."""
+    head = sample_head(file)
+    if not head:
+        return 0.0
+    raw = pl.read_csv(io.BytesIO(head), separator="\t", has_header=False, columns=list(BED_COLUMNS))
+    bed = clean_bed(raw).cast({"start": pl.UInt64, "end": pl.UInt64, "coverage": pl.UInt64})
+    if collapse:
+        sites = collapse_strands(bed.lazy().cast({"percent_methylated": pl.UInt64})).collect()
+    else:
+        sites = bed.rename({"coverage": "total_coverage"})
+    return sites.filter(pl.col("total_coverage") >= mincov).height / raw.height
+
+
+def reference_rows(config):
+    """Reference sites and the existing index, if any (see ``reference.find_reference``).
+
+    Without an index the row count comes from the reference's parquet metadata, before the
+    sex chromosomes and blacklist are removed.
+    """
+    index = find_reference(config.ref, config.exclude, config.refIndex or Path(config.ref).parent)
+    if index:
+        return sum(info["rows"] for info in reference_meta(index)["chromosomes"].values()), index
+    return pl.scan_parquet(config.ref).select(pl.len()).collect().item(), None
+
+
+def largest_chromosome(config, index):
+    """Reference sites on the largest chromosome, which one shard joins against (see ``--shards``)."""
+    if index:
+        return max(info["rows"] for info in reference_meta(index)["chromosomes"].values())
+    return pl.scan_parquet(config.ref).group_by("chr").len().select(pl.col("len").max()).collect().item()
+
+
+def estimate_sample(file, config, ref_rows, shard_rows=None):
+    """Row counts, per-stage memory (MB) and runtime (seconds) of imputing one sample.
+
+    With ``shard_rows`` (reference sites of the largest chromosome) the stages are those of a
+    sharded run: the sample is read whole, then joined one chromosome at a time.
+    """
+    input_rows = estimate_rows(file)
+    observed = int(input_rows * observed_share(file, config.minCov, config.collapse))
+    missing = max(ref_rows - observed, 0)
+    factor = COMPACT_FACTOR if config.compact else 1
+
+    if shard_rows is not None:
+        shard_input = input_rows * shard_rows / ref_rows if ref_rows else 0
+        stages = {
+            "split_sample": input_rows * INPUT_ROW_BYTES / 2**20,
+            "impute_shard": (shard_input * INPUT_ROW_BYTES + shard_rows * REF_ROW_BYTES) / 2**20 * factor,
+        }
+    else:
+        stages = {
+            "read_files": input_rows * INPUT_ROW_BYTES / 2**20,
+            "missing_sites": (input_rows * INPUT_ROW_BYTES + ref_rows * REF_ROW_BYTES) / 2**20 * factor,
+        }
+    if config.ml:
+        training = min(observed, config.trainRows) if config.trainRows else observed
+        stages["h2oPrep"] = max(stages.values()) + (training + missing) * FEATURE_ROW_BYTES / 2**20
+
+    return {
+        "input_rows": input_rows,
+        "observed_rows": observed,
+        "missing_rows": missing,
+        "frame_mb": {
+            "observed": observed * OBSERVED_ROW_BYTES / 2**20,
+            "reference_join": ref_rows * REF_ROW_BYTES / 2**20 * factor,
+        },
+        "stage_mb": stages,
+        "peak_mb": max(stages.values()),
+        "seconds": (input_rows + ref_rows) / ROWS_PER_SECOND,
+    }
+
+
+def ml_seconds(config, n_samples):
+    """Upper bound on machine learning training time: one ``runTime`` per model trained."""
+    if not config.ml or config.model:
+        return 0
+    return config.runTime * (1 if config.trainSamples else n_samples)
+
+
+def plan_run(config, bed_paths, params=None):
+    """Estimate a run from file sizes, sampled lines and reference metadata, without imputing.
+
+    With the run's ``params`` (see ``Pipeline.params``) and unless ``rerun`` is set, samples that
+    the run manifest records as up to date are skipped, as ``Pipeline.run`` would skip them. The
+    manifest is matched on the index's reference hash, so before the index is built every sample
+    is estimated.
+
+    Returns:
+        dict with the reference rows, per-sample estimates (see ``estimate_sample``), the skipped
+        samples, the memory budget and the batches ``Pipeline.save`` would collect together or
+        stream; with ``shards``, the memory of that many shards at once instead of batches.
+    """
+    ref_rows, index = reference_rows(config)
+    skipped = []
+    if params is not None and index and not config.rerun:
+        manifest = RunManifest(config.output, reference_meta(index)["hash"], params, config.outputFormat)
+        pending = manifest.pending(bed_paths)
+        skipped = [sample_name(bed) for bed in bed_paths if bed not in pending]
+        bed_paths = pending
+
+    shard_rows = largest_chromosome(config, index) if config.shards > 0 else None
+    samples = {sample_name(bed): estimate_sample(bed, config, ref_rows, shard_rows) for bed in bed_paths}
+    estimates = {name: sample["peak_mb"] for name, sample in samples.items()}
+    budget = config.memoryBudget or (available_memory_mb() or 8192) / 2
+
+    if config.shards > 0:
+        batches, streamed = [], []
+    elif config.streaming:
+        batches, streamed = [], list(samples)
+    else:
+        batches, streamed = plan_batches(list(samples), estimates, budget, config.maxConcurrent)
+
+    return {
+        "reference_rows": ref_rows,
+        "reference_index": str(index) if index else None,
+        "samples": samples,
+        "skipped": skipped,
+        "budget_mb": budget,
+        "batches": batches,
+        "streamed": streamed,
+        "shards": config.shards,
+        "shards_mb": config.shards * max(estimates.values(), default=0),  # one shard or split per process
+        "impute_seconds": sum(sample["seconds"] for sample in samples.values()),
+        "ml_seconds": ml_seconds(config, len(samples)),
+    }
+
+
+def query_plans(pipeline, bed_paths):
+    """Optimised Polars plans of each sample's imputation as ``Pipeline.impute`` builds it, by name.
+
+    The ``pipeline`` must have its reference loaded (see ``Pipeline.load_reference``). Inputs that
+    would have to be parsed first, gzipped or not yet in the input cache, get no plan.
+    """
+    c = pipeline.config
+    plans = {sample_name(bed): None for bed in bed_paths}
+    if c.inputCache:
+        args = (c.minCov, c.collapse, c.inputCache, c.approxQuantile, c.sortedInput)
+        ready = [bed for bed in bed_paths if cache_file(bed, *args).exists()]
+    else:
+        ready = [bed for bed in bed_paths if not is_gzip(bed)]
+
+    if ready:
+        results = pipeline.impute(ready, c.output, explain=True)
+        plans.update({name: lf.explain(optimized=True, streaming=c.streaming) for name, lf in results.items()})
+    return plans
+
+
+def print_plan(plan, plans=None):
+    """Print a run estimate (see ``plan_run``) and any query plans."""
+    print(f"Reference: {plan['reference_rows']:,} sites ({plan['reference_index'] or 'index not built yet'})")
+    for name, sample in plan["samples"].items():
+        stages = ", ".join(f"{stage} {mb:,.0f} MB" for stage, mb in sample["stage_mb"].items())
+        print(
+            f"{name}: ~{sample['input_rows']:,} rows, ~{sample['observed_rows']:,} observed, "
+            f"~{sample['missing_rows']:,} missing; peak {sample['peak_mb']:,.0f} MB ({stages}); "
+            f"~{sample['seconds']:,.0f} s"
+        )
+    if plan["skipped"]:
+        print(f"Skipping {len(plan['skipped'])} sample(s) with up-to-date outputs")
+    batches, streamed = plan["batches"], plan["streamed"]
+    if plan["shards"]:
+        print(f"Sharded across {plan['shards']} processes: up to ~{plan['shards_mb']:,.0f} MB at once")
+    else:
+        print(f"Memory budget {plan['budget_mb']:,.0f} MB: {len(batches)} batch(es), {len(streamed)} streamed")
+    for i, batch in enumerate(batches, start=1):
+        print(f"  batch {i}: {', '.join(batch)}")
+    print(f"Estimated imputation time ~{plan['impute_seconds']:,.0f} s on one core")
+    if plan["ml_seconds"]:
+        print(f"Machine learning training up to {plan['ml_seconds']:,} s")
+
+    for name, text in (plans or {}).items():
+        print(f"\nPlan for {name}:")
+        print(text or "(not built: the input is parsed first)")
@@ -0,0 +1,160 @@
+"""Build and reuse the filtered reference CpG index."""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import polars as pl
+
+from .files import ROW_GROUP_SIZE
+from .manifest import fingerprint
+from .regions import chromosome_filter
+
+INDEX_VERSION = 2  # 2: row groups of ROW_GROUP_SIZE, so region scans can skip them
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Hash file contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reference_key(ref, blacklist):
+    """Content hash of the reference and blacklist."""
+    digest = hashlib.sha256(f"v{INDEX_VERSION}".encode())
+    digest.update(file_hash(ref).encode())
+    if blacklist:
+        digest.update(file_hash(blacklist).encode())
+    return digest.hexdigest()
+
+
+def source_fingerprint(ref, blacklist):
+    """Cheap fingerprints (see ``manifest.fingerprint``) of the reference and blacklist files."""
+    return {"ref": fingerprint(ref), "blacklist": fingerprint(blacklist) if blacklist else None}
+
+
+def find_reference(ref, blacklist, index_dir):
+    """Existing index of the reference and blacklist in ``index_dir``, or ``None``.
+
+    Indexes are matched on ``source_fingerprint`` rather than on the content hash that names them,
+    so looking one up does not read the reference. Indexes written without a fingerprint are not found.
+    """
+    expected = source_fingerprint(ref, blacklist)
+    for meta_file in sorted(Path(index_dir).glob("ref_*/index.json")):
+        meta = json.loads(meta_file.read_text())
+        if meta["version"] == INDEX_VERSION and meta.get("fingerprint") == expected:
+            return meta_file.parent
+    return None
+
+
+def build_reference(ref, blacklist, index_dir):
+    """Write the reference once, partitioned by chromosome and sorted, with the blacklist applied.
+
+    The index lives in ``index_dir/ref_<hash>`` where ``<hash>`` is taken from the contents of
+    the reference and blacklist files, so an existing index is reused as long as neither changes.
+    """
+    key = reference_key(ref, blacklist)
+    outdir = Path(index_dir, f"ref_{key[:16]}")
+    meta_file = outdir / "index.json"
+
+    if meta_file.exists() and json.loads(meta_file.read_text())["hash"] == key:
+        print(f"Reusing reference index {outdir}")
+        return outdir
+
+    print(f"Building reference index {outdir}")
+    ref_lf = (
+        pl.scan_parquet(ref, parallel="row_groups")
+        .cast({"chr": pl.Utf8, "start": pl.UInt64, "end": pl.UInt64})
+        .select(["chr", "start", "end"])
+    ).filter(~pl.col("chr").is_in(["Y", "X"]))
+
+    if blacklist:
+        blacklist_lf = (
+            pl.scan_parquet(blacklist, parallel="row_groups")
+            .cast({"chr": pl.Utf8, "start": pl.UInt64})
+            .select(["chr", "start"])
+        )
+        ref_lf = ref_lf.join(blacklist_lf, how="anti", on=["chr", "start"])
+
+    ref_df = ref_lf.collect()
+
+    tmpdir = Path(index_dir, f".tmp_ref_{key[:16]}_{os.getpid()}")
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    tmpdir.mkdir(parents=True)
+
+    chromosomes = {}
+    for (chrom,), part in ref_df.partition_by("chr", maintain_order=True, as_dict=True).items():
+        filename = f"chr_{chrom}.parquet"
+        part.sort("start").write_parquet(tmpdir / filename, statistics=True, row_group_size=ROW_GROUP_SIZE)
+        chromosomes[chrom] = {"file": filename, "rows": part.height}
+
+    meta = {
+        "version": INDEX_VERSION,
+        "hash": key,
+        "ref": str(ref),
+        "blacklist": str(blacklist) if blacklist else None,
+        "fingerprint": source_fingerprint(ref, blacklist),
+        "chromosomes": chromosomes,
+    }
+    (tmpdir / "index.json").write_text(json.dumps(meta, indent=2))
+
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.replace(tmpdir, outdir)  # publish the finished index in one step
+
+    return outdir
+
+
+def reference_meta(index):
+    """Read index metadata."""
+    return json.loads(Path(index, "index.json").read_text())
+
+
+def compact_schema(index):
+    """Compact dtypes for a run against this index.
+
+    The chromosome becomes an Enum of the index's chromosomes, positions ``UInt32`` (enough for any
+    chromosome under 4.29 Gb) and methylation ``Float32``, roughly halving join keys and fills.
+    """
+    return compact_dtypes(list(reference_meta(index)["chromosomes"]))
+
+
+def compact_dtypes(chromosomes):
+    """``compact_schema`` for a list of chromosomes."""
+    return {"chr": pl.Enum(chromosomes), "start": pl.UInt32, "end": pl.UInt32, "avg": pl.Float32}
+
+
+def scan_reference(index, chromosomes=None, schema=None, regions=None):
+    """Scan the reference index, optionally restricted to some chromosomes.
+
+    ``schema`` (see ``compact_schema``) overrides the dtypes of the ``chr``, ``start`` and ``end``
+    columns. ``regions`` (see ``regions.merge_regions``) keeps only sites inside them; each
+    chromosome is scanned with its own filter so that row groups outside the regions are not read.
+    """
+    meta = reference_meta(index)
+    files = {
+        chrom: Path(index, info["file"])
+        for chrom, info in meta["chromosomes"].items()
+        if chromosomes is None or chrom in chromosomes
+    }
+    scans = [pl.scan_parquet(list(files.values()), parallel="row_groups")] if files else []
+
+    if regions is not None:
+        scans = []
+        for chrom, file in files.items():
+            filters = chromosome_filter(regions, chrom)
+            if filters:
+                scans.append(pl.scan_parquet(file).filter(filters[0]).filter(filters[1]))
+
+    if not scans:
+        ref = pl.LazyFrame(schema={"chr": pl.Utf8, "start": pl.UInt64, "end": pl.UInt64})
+    else:
+        ref = pl.concat(scans)
+
+    if schema:
+        ref = ref.cast({col: schema[col] for col in ("chr", "start", "end")})
+    return ref
@@ -0,0 +1,98 @@
+"""Restrict a run to a panel of regions."""
+
+from functools import reduce
+from operator import or_
+
+import polars as pl
+
+from .missing import site_key
+
+MAX_PUSHDOWN_INTERVALS = 16  # per chromosome; each is one comparison per row, but lets row groups be skipped
+
+
+def read_regions(path):
+    """Read regions (chr, start, end; half-open like BED) from a parquet or BED file."""
+    if str(path).endswith(".parquet"):
+        regions = pl.read_parquet(path, columns=["chr", "start", "end"])
+    else:
+        regions = pl.read_csv(
+            path,
+            separator="\t",
+            has_header=False,
+            columns=[0, 1, 2],
+            comment_prefix="#",
+            new_columns=["chr", "start", "end"],
+        )
+
+    return regions.select(
+        pl.col("chr").cast(pl.Utf8).str.replace_all(r"(?i)Chr", ""),  # match the reference, as read_files does
+        pl.col("start").cast(pl.Int64),
+        pl.col("end").cast(pl.Int64),
+    )
+
+
+def merge_regions(regions, flank=0):
+    """Widen regions by ``flank`` bases on each side and merge those that overlap.
+
+    ``flank=None`` widens every region to its whole chromosome.
+    """
+    if flank is None:
+        return regions.group_by("chr", maintain_order=True).agg(
+            pl.lit(0, pl.Int64).alias("start"), pl.lit(2**32 - 1, pl.Int64).alias("end")
+        )
+
+    return (
+        regions.with_columns((pl.col("start") - flank).clip(lower_bound=0), pl.col("end") + flank)
+        .sort("chr", "start")
+        .with_columns(
+            (pl.col("start") > pl.col("end").cum_max().shift().over("chr")).fill_null(True).cum_sum().alias("group")
+        )
+        .group_by("chr", "group", maintain_order=True)
+        .agg(pl.col("start").min(), pl.col("end").max())
+        .drop("group")
+    )
+
+
+def boundaries(starts, ends):
+    """Interleaved region starts and ends; a position is inside when it has an odd number at or below it."""
+    return pl.Series([pos for pair in zip(starts, ends, strict=True) for pos in pair], dtype=pl.UInt64)
+
+
+def in_regions(merged, chromosomes):
+    """Expression that is true for sites inside merged regions, on any of ``chromosomes``."""
+    rank = {chrom: i for i, chrom in enumerate(chromosomes)}
+    offset = pl.col("chr").replace_strict(rank, return_dtype=pl.UInt64) * 2**32
+    merged = (
+        merged.filter(pl.col("chr").is_in(chromosomes))
+        .select(
+            (offset + pl.col("start").cast(pl.UInt64)).alias("start"),
+            (offset + pl.col("end").cast(pl.UInt64)).alias("end"),
+        )
+        .sort("start")
+    )
+    bounds = boundaries(merged["start"], merged["end"])
+
+    return pl.lit(bounds).search_sorted(site_key(chromosomes), side="right") % 2 == 1
+
+
+def chromosome_filter(merged, chrom, limit=MAX_PUSHDOWN_INTERVALS):
+    """Filters selecting one chromosome's sites inside merged regions.
+
+    The first is a handful of ranges that the parquet reader checks against row group statistics,
+    made by merging the regions across all but the ``limit - 1`` widest gaps; the second is the
+    exact test. Returns ``None`` if the chromosome has no regions.
+    """
+    merged = merged.filter(chr=chrom).sort("start")
+    if merged.is_empty():
+        return None
+
+    starts, ends = merged["start"].to_list(), merged["end"].to_list()
+    gaps = sorted(range(1, len(starts)), key=lambda i: starts[i] - ends[i - 1], reverse=True)
+    cuts = sorted(gaps[: limit - 1])
+    coarse = [
+        pl.col("start").is_between(starts[lo], ends[hi - 1] - 1)
+        for lo, hi in zip([0, *cuts], [*cuts, len(starts)], strict=True)
+    ]
+
+    exact = pl.lit(boundaries(starts, ends)).search_sorted(pl.col("start").cast(pl.UInt64), side="right") % 2 == 1
+    return reduce(or_, coarse), exact
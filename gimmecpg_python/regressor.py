@@ -0,0 +1,83 @@
+"""In-process regressor for machine learning imputation."""
+
+from itertools import combinations_with_replacement
+
+import numpy as np
+
+
+class NumpyRegressor:
+    """Polynomial ridge regression, fitted and applied with vectorised NumPy.
+
+    Missing feature values (e.g. a neighbour distance bin without a correlation) are replaced by the
+    training mean. Features are standardised, expanded to all products up to ``degree`` and fitted
+    in closed form; the normal equations are accumulated in chunks so memory stays bounded.
+    """
+
+    def __init__(self, degree=2, alpha=1.0, chunk_size=1_000_000):
+        """Set model options."""
+        self.degree = degree
+        self.alpha = alpha
+        self.chunk_size = chunk_size
+        self.mean = None
+        self.scale = None
+        self.coef = None
+
+    def expand(self, columns):
+        """Standardise and expand feature columns to polynomial terms."""
+        cols = [np.where(np.isnan(col), mean, col) for col, mean in zip(columns, self.mean, strict=True)]
+        cols = [(col - mean) / scale for col, mean, scale in zip(cols, self.mean, self.scale, strict=True)]
+
+        terms = [np.ones_like(cols[0])]
+        for degree in range(1, self.degree + 1):
+            for idx in combinations_with_replacement(range(len(cols)), degree):
+                terms.append(np.prod([cols[i] for i in idx], axis=0))
+        return np.column_stack(terms)
+
+    def fit(self, columns, y):
+        """Fit on a list of 1-d feature arrays."""
+        observed = [col[np.isfinite(col)] for col in columns]
+        self.mean = [col.mean() if len(col) else 0.0 for col in observed]
+        self.scale = [col.std() if len(col) and col.std() > 0 else 1.0 for col in observed]
+
+        xtx = None
+        xty = None
+        for start in range(0, len(y), self.chunk_size):
+            stop = start + self.chunk_size
+            x = self.expand([col[start:stop] for col in columns])
+            xtx = x.T @ x if xtx is None else xtx + x.T @ x
+            xty = x.T @ y[start:stop] if xty is None else xty + x.T @ y[start:stop]
+
+        penalty = self.alpha * np.eye(len(xtx))
+        penalty[0, 0] = 0  # do not shrink the intercept
+        self.coef = np.linalg.solve(xtx + penalty, xty)
+        return self
+
+    def predict(self, columns):
+        """Predict from a list of 1-d feature arrays."""
+        n = len(columns[0])
+        out = np.empty(n)
+        for start in range(0, n, self.chunk_size):
+            stop = start + self.chunk_size
+            out[start:stop] = self.expand([col[start:stop] for col in columns]) @ self.coef
+        return out
+
+    def save(self, path):
+        """Save fitted parameters."""
+        np.savez(
+            path,
+            degree=self.degree,
+            alpha=self.alpha,
+            mean=self.mean,
+            scale=self.scale,
+            coef=self.coef,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load fitted parameters."""
+        params = np.load(path)
+        model = cls(degree=int(params["degree"]), alpha=float(params["alpha"]))
+        model.mean = list(params["mean"])
+        model.scale = list(params["scale"])
+        model.coef = params["coef"]
+        return model
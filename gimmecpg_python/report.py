@@ -0,0 +1,91 @@
+"""Per-stage instrumentation and the JSON run report."""
+
+import contextvars
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+CURRENT_SAMPLE = contextvars.ContextVar("sample", default=None)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, KiB on Linux
+
+
+def rss_mb():
+    """Current resident memory, where /proc is available."""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+    except OSError:
+        return None
+    return pages * resource.getpagesize() / 2**20
+
+
+class RunReport:
+    """Records wall time, memory and row counts for each (sample, stage) of a run.
+
+    ``peak_rss_mb`` is the process high-water mark when the stage finished, so a stage that raises
+    it is the one that set the peak; ``rss_mb`` is the resident memory at the end of the stage.
+    """
+
+    def __init__(self):
+        """Start an empty report."""
+        self.include_plans = False
+        self.reset()
+
+    def reset(self):
+        """Drop all records and restart the clock (e.g. between runs of a long-lived pipeline)."""
+        self.started = time.time()
+        self.records = []
+        self.plans = {}
+
+    @contextmanager
+    def sample(self, name):
+        """Attribute stages run inside this block to ``name``."""
+        token = CURRENT_SAMPLE.set(name)
+        try:
+            yield
+        finally:
+            CURRENT_SAMPLE.reset(token)
+
+    @contextmanager
+    def stage(self, name, sample=None, rows_in=None):
+        """Time a stage; the yielded dict can be given ``rows_out`` or any other field."""
+        record = {"sample": sample or CURRENT_SAMPLE.get(), "stage": name, "rows_in": rows_in, "rows_out": None}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["rss_mb"] = rss_mb()
+            self.records.append(record)
+
+    def extend(self, records):
+        """Add records measured elsewhere (e.g. in worker processes)."""
+        self.records.extend(records)
+
+    def plan(self, name, lf):
+        """Keep the optimised query plan of a lazy result, if plans were requested."""
+        if self.include_plans:
+            self.plans[name] = lf.explain(optimized=True)
+
+    def write(self, path, params=None):
+        """Write the report as JSON."""
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "wall_seconds": time.time() - self.started,
+            "peak_rss_mb": peak_rss_mb(),
+            "params": params,
+            "stages": self.records,
+            "plans": self.plans,
+        }
+        Path(path).write_text(json.dumps(report, indent=2, default=str))
+
+
+REPORT = RunReport()
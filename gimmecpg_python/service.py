@@ -0,0 +1,66 @@
+"""Local HTTP service that keeps a pipeline warm between requests."""
+
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .report import REPORT
+
+
+def handler(pipeline):
+    """Request handler class bound to a prepared pipeline.
+
+    ``POST /impute`` takes ``{"beds": [paths], "output": optional directory}``, runs the pipeline on
+    those files and returns its summary; ``GET /health`` reports that the service is up. Requests
+    are handled one at a time, so runs never compete for memory or for the backend.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.reply(200, {"status": "ok", "reference": str(pipeline.ref_index)})
+            else:
+                self.reply(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/impute":
+                self.reply(404, {"error": f"unknown path {self.path}"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                beds = request["beds"]
+            except (ValueError, KeyError, TypeError):
+                self.reply(400, {"error": 'expected a JSON body like {"beds": ["sample.bed"]}'})
+                return
+
+            REPORT.reset()  # each request gets its own run report
+            try:
+                summary = pipeline.run(beds, request.get("output"))
+            except Exception as err:  # noqa: BLE001 - reported to the client, the service keeps running
+                self.reply(500, {"error": f"{type(err).__name__}: {err}"})
+                return
+            summary["failed"] = {name: str(err) for name, err in summary["failed"].items()}
+            self.reply(500 if summary["failed"] else 200, summary)
+
+    return Handler
+
+
+def serve(pipeline, host="127.0.0.1", port=8765):
+    """Serve imputation requests for a prepared pipeline until interrupted."""
+    server = HTTPServer((host, port), handler(pipeline))
+    print(f"Serving imputation on http://{host}:{server.server_port} (POST /impute, GET /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if pipeline.backend:
+            pipeline.backend.reset()
@@ -0,0 +1,133 @@
+"""Per-chromosome sharded execution."""
+
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from pathlib import Path
+
+import polars as pl
+
+from .cache import scan_input
+from .files import imputed_sites, sample_name, sink_files, split_chromosomes, standard_dtypes
+from .impute import fast_impute
+from .missing import missing_sites
+from .reference import reference_meta, scan_reference
+from .report import REPORT, RunReport
+
+BED_SCHEMA = {"chr": pl.Utf8, "start": pl.UInt64, "strand": pl.Utf8, "avg": pl.Float64, "sample": pl.Utf8}
+
+
+def split_sample(bed, mincov, collapse, streaming, workdir, schema=None, approx=False, cache=None, presorted=False):
+    """Read a sample once and split its observed sites by chromosome.
+
+    The sample's observed sites are collected whole to be split, so this step holds one sample
+    genome-wide; it is the reference join that the per-chromosome shards keep small.
+    """
+    name = sample_name(bed)
+    sample_dir = Path(workdir, name)
+    sample_dir.mkdir(parents=True, exist_ok=True)
+
+    report = RunReport()  # runs in a worker process; records go back to the parent
+    with report.stage("split_sample", sample=name) as record:
+        data = scan_input(bed, mincov, collapse, schema, approx, cache, presorted, sample_dir)
+        data = data.collect(streaming=streaming)
+        record["rows_out"] = data.height
+
+    return name, split_chromosomes(data, sample_dir), report.records
+
+
+def impute_shard(name, chrom, obs, ref_index, dist, streaming, workdir, schema=None):
+    """Impute one chromosome of one sample; shards are written with the output dtypes."""
+    bed = pl.scan_parquet(obs) if obs else pl.LazyFrame(schema=BED_SCHEMA)
+    if schema:
+        bed = bed.cast({col: schema[col] for col in ("chr", "start", "avg")})
+    missing = missing_sites(bed, scan_reference(ref_index, [chrom], schema), [chrom], dist)
+
+    outfile = Path(workdir, name, f"imputed_chr_{chrom}.parquet")
+    report = RunReport()
+    with report.stage("impute_shard", sample=name) as record:
+        imputed = standard_dtypes(fast_impute(missing, dist)).collect(streaming=streaming)
+        imputed.write_parquet(outfile)
+        record["chr"] = chrom
+        record["rows_out"] = imputed.height
+
+    return outfile, report.records
+
+
+def stitch_shards(name, shards, outpath, fmt, imputed_only=False):
+    """Concatenate chromosome shards into the per-sample output, in reference order."""
+    result = pl.scan_parquet(shards)
+    if imputed_only:
+        result = imputed_sites(result)
+    return sink_files(result, name, outpath, fmt)
+
+
+def run_sharded(
+    bed_paths,
+    ref_index,
+    mincov,
+    collapse,
+    dist,
+    streaming,
+    workers,
+    outpath,
+    fmt,
+    manifest=None,
+    schema=None,
+    approx=False,
+    cache=None,
+    presorted=False,
+    imputed_only=False,
+):
+    """Run fast imputation as (sample, chromosome) shards across a process pool.
+
+    Each sample is read and split by chromosome once (holding its observed sites, see
+    ``split_sample``), then every chromosome is imputed as its own task, so at most ``workers``
+    shards are in memory at any time and the reference join follows the largest chromosome rather
+    than the whole genome. Samples are stitched back together and saved
+    as soon as all of their shards are done, and recorded in ``manifest`` if one is given.
+    ``schema`` (see ``reference.compact_schema``) is used for the per-chromosome work, and samples are
+    read through the parsed-input ``cache`` directory if one is given (see ``cache.scan_input``).
+    ``imputed_only`` saves only the imputed sites.
+    """
+    chromosomes = list(reference_meta(ref_index)["chromosomes"])
+    workdir = Path(tempfile.mkdtemp(prefix=".gimmecpg_shards_", dir=outpath))
+
+    try:
+        # spawn rather than fork: forking a process that already runs Polars' thread pool can deadlock
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+            pending = {
+                executor.submit(
+                    split_sample, bed, mincov, collapse, streaming, workdir, schema, approx, cache, presorted
+                ): None
+                for bed in bed_paths
+            }
+            shards = {}
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+
+                    if key is None:  # sample split, queue its chromosomes
+                        name, obs, records = future.result()
+                        REPORT.extend(records)
+                        print(f"Split {name} into {len(chromosomes)} chromosome shards")
+                        shards[name] = dict.fromkeys(chromosomes)
+                        for chrom in chromosomes:
+                            shard = executor.submit(
+                                impute_shard, name, chrom, obs.get(chrom), ref_index, dist, streaming, workdir, schema
+                            )
+                            pending[shard] = (name, chrom)
+                        continue
+
+                    name, chrom = key
+                    shards[name][chrom], records = future.result()
+                    REPORT.extend(records)
+                    if all(shards[name].values()):
+                        print(stitch_shards(name, list(shards.pop(name).values()), outpath, fmt, imputed_only))
+                        if manifest:
+                            manifest.done(name)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
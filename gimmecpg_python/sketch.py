@@ -0,0 +1,69 @@
+"""Approximate quantiles that do not block streaming."""
+
+import polars as pl
+
+RELATIVE_ACCURACY = 0.005
+ZERO_BUCKET = -(2**31)  # zeros (and smaller values) sort before every logarithmic bucket
+
+
+def sketch(lf, col, alpha=RELATIVE_ACCURACY):
+    """Logarithmic bucket counts of a non-negative column (a DDSketch).
+
+    Values in ``(gamma**(k-1), gamma**k]`` with ``gamma = (1 + alpha) / (1 - alpha)`` share bucket
+    ``k``, so there are only a few thousand buckets whatever the number of rows. The counts are a
+    plain ``group_by``, which the streaming engine computes chunk by chunk, and sketches of
+    different chunks merge by summing the counts of equal buckets.
+    """
+    gamma = (1 + alpha) / (1 - alpha)
+    value = pl.col(col)
+    bucket = pl.when(value > 0).then(value.log(gamma).ceil()).otherwise(ZERO_BUCKET).cast(pl.Int32)
+    return lf.select(value).drop_nulls().group_by(bucket.alias("bucket")).agg(pl.col(col).len().alias("count"))
+
+
+def sketch_quantile(sketch_lf, q, alpha=RELATIVE_ACCURACY):
+    """One-row frame with the ``q`` quantile (``"nearest"`` interpolation) of a sketch.
+
+    The result is within ``alpha`` relative error of the exact quantile: the value at that rank
+    lies in the returned bucket, which is estimated by the point closest to both of its ends.
+    """
+    gamma = (1 + alpha) / (1 - alpha)
+    bucket = pl.col("bucket").first()
+    estimate = 2 * pl.lit(gamma).pow(bucket) / (gamma + 1)
+    return (
+        sketch_lf.sort("bucket")
+        .filter(pl.col("count").cum_sum() > (q * (pl.col("count").sum() - 1)).round())
+        .select(pl.when(bucket == ZERO_BUCKET).then(0.0).otherwise(estimate).alias("quantile"))
+    )
+
+
+def counts_quantile(counts_lf, col, q):
+    """One-row frame with the exact ``q`` quantile (``"nearest"`` interpolation) of a column from its value counts.
+
+    ``counts_lf`` has one row per distinct value of ``col`` and how often it occurs (``count``);
+    counts of different chunks merge like sketches.
+    """
+    return (
+        counts_lf.sort(col)
+        .filter(pl.col("count").cum_sum() > (q * (pl.col("count").sum() - 1)).round())
+        .select(pl.col(col).first().cast(pl.Float64).alias("quantile"))
+    )
+
+
+def approx_quantile(lf, col, q, alpha=RELATIVE_ACCURACY):
+    """Approximate ``q`` quantile of a non-negative column, as a one-row frame to cross join."""
+    if not 0 < alpha < 1:
+        raise ValueError(f"relative accuracy must be between 0 and 1, got {alpha}")
+    return sketch_quantile(sketch(lf, col, alpha), q, alpha)
+
+
+def with_quantile(lf, col, q, name, approx=False):
+    """Add the ``q`` quantile of ``col`` to every row as ``name``.
+
+    The exact quantile needs the whole column at once; with ``approx`` it comes from a sketch
+    (within ``RELATIVE_ACCURACY`` of the exact value), so the rest of the query can stream.
+    The sketch is a second pass over ``lf``: its sources are scanned twice, so ``lf`` should
+    scan files (as ``files.read_files`` does) rather than wrap an expensive computation.
+    """
+    if not approx:
+        return lf.with_columns(pl.col(col).quantile(q, "nearest").alias(name))
+    return lf.join(approx_quantile(lf, col, q).rename({"quantile": name}), how="cross")
@@ -0,0 +1,88 @@
+"""Synthetic reference and methylation data for tests and benchmarks."""
+
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+
+def make_reference(n_sites, n_chromosomes=22, mean_gap=100, seed=1):
+    """Reference CpG sites spread over autosomes, with chromosome sizes proportional to 1/sqrt(chr).
+
+    Gaps between consecutive CpGs are geometric with mean ``mean_gap`` (minimum 2, so the two
+    strands of neighbouring CpGs never overlap).
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, n_chromosomes + 1) ** 0.5
+    counts = rng.multinomial(n_sites, weights / weights.sum())
+
+    frames = []
+    for chrom, count in enumerate(counts, start=1):
+        starts = np.cumsum(rng.geometric(1 / mean_gap, count) + 1)
+        frames.append(
+            pl.DataFrame({"chr": str(chrom), "start": starts.astype(np.uint64), "end": (starts + 1).astype(np.uint64)})
+        )
+    return pl.concat(frames)
+
+
+def make_sample(ref, coverage=15, dispersion=2.0, missingness=0.3, seed=1):
+    """Per-strand bismark-style calls for a random subset of reference CpGs.
+
+    Coverage is negative binomial with mean ``coverage`` (smaller ``dispersion`` means more
+    overdispersed), a ``missingness`` share of CpGs is dropped, and methylation follows a smooth
+    bimodal profile along each chromosome so that neighbouring sites are correlated.
+    """
+    rng = np.random.default_rng(seed)
+    n = ref.height
+
+    keep = rng.random(n) >= missingness
+    level = np.where(np.sin(ref.get_column("start").to_numpy() / 5000.0) > 0, 0.85, 0.1)
+    beta = np.clip(level + rng.normal(0, 0.1, n), 0, 1)
+
+    def coverage_draw():
+        p = dispersion / (dispersion + coverage)
+        return rng.negative_binomial(dispersion, p, n)
+
+    sites = ref.with_columns(
+        pl.Series("beta", beta),
+        pl.Series("cov_pos", coverage_draw()),
+        pl.Series("cov_neg", coverage_draw()),
+    ).filter(pl.Series(keep))
+
+    def strand(cov, strand, offset):
+        return sites.select(
+            ("chr" + pl.col("chr")).alias("chr"),
+            (pl.col("start") + offset).alias("start"),
+            (pl.col("end") + offset).alias("end"),
+            pl.lit(".").alias("name"),
+            pl.lit(0).alias("score"),
+            pl.lit(strand).alias("strand"),
+            pl.lit(".").alias("thick_start"),
+            pl.lit(".").alias("thick_end"),
+            pl.lit(".").alias("rgb"),
+            pl.col(cov).cast(pl.UInt64).alias("coverage"),
+            (pl.col("beta") * 100).round().cast(pl.UInt64).alias("percent_methylated"),
+        ).filter(pl.col("coverage") > 0)
+
+    return pl.concat([strand("cov_pos", "+", 0), strand("cov_neg", "-", 1)]).sort(["chr", "start"])
+
+
+def write_dataset(outdir, n_sites, n_samples=1, seed=1, **kwargs):
+    """Write ``ref.parquet`` and ``sample_<i>.bed`` files, returning their paths.
+
+    Extra keyword arguments are passed to ``make_sample``.
+    """
+    outdir = Path(outdir)
+    (outdir / "beds").mkdir(parents=True, exist_ok=True)
+
+    ref = make_reference(n_sites, seed=seed)
+    ref_path = outdir / "ref.parquet"
+    ref.write_parquet(ref_path)
+
+    bed_paths = []
+    for i in range(n_samples):
+        path = outdir / "beds" / f"sample_{i}.bed"
+        make_sample(ref, seed=seed + i + 1, **kwargs).write_csv(path, separator="\t")  # header row is skipped
+        bed_paths.append(path)
+
+    return ref_path, bed_paths
@@ -0,0 +1,38 @@
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from gimmecpg_python.cache import cache_input, scan_input
+from gimmecpg_python.files import read_files
+from gimmecpg_python.reference import build_reference, compact_schema
+from gimmecpg_python.synthetic import write_dataset
+
+
+def test_cached_input_matches_bed_and_is_reused(tmp_path):
+    ref_path, (bed,) = write_dataset(tmp_path, 2000)
+    cache = tmp_path / "cache"
+
+    cached = cache_input(bed, 5, True, cache)
+    built = cached.stat().st_mtime_ns
+    assert cache_input(bed, 5, True, cache) == cached
+    assert cached.stat().st_mtime_ns == built
+    assert cache_input(bed, 10, True, cache) != cached
+    assert cache_input(bed, 5, True, cache, presorted=True) != cached
+
+    expected = read_files(bed, 5, True).collect().sort(["chr", "start"])
+    assert_frame_equal(scan_input(bed, 5, True, cache_dir=cache).collect(), expected)
+
+    schema = compact_schema(build_reference(ref_path, None, tmp_path))
+    compact = scan_input(bed, 5, True, schema, cache_dir=cache).collect().sort(["chr", "start"])
+    assert compact.schema["chr"] == schema["chr"]
+    assert_frame_equal(compact, read_files(bed, 5, True, schema).collect().sort(["chr", "start"]))
+
+
+def test_cached_input_rebuilt_when_bed_changes(tmp_path):
+    _, (bed,) = write_dataset(tmp_path, 2000)
+    cached = cache_input(bed, 5, False, tmp_path / "cache")
+
+    with open(bed, "a") as fh:
+        fh.write("chr1\t1\t2\t.\t0\t+\t.\t.\t.\t50\t100\n")
+    rebuilt = cache_input(bed, 5, False, tmp_path / "cache")
+    assert rebuilt != cached
+    assert pl.read_parquet(rebuilt).height == pl.read_parquet(cached).height + 1
@@ -0,0 +1,38 @@
+import json
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from gimmecpg_python.cluster import load_manifest, main, merge_units, pending_units, run_unit
+from gimmecpg_python.files import output_file
+from gimmecpg_python.pipeline import Config, Pipeline
+from gimmecpg_python.synthetic import write_dataset
+
+
+def test_units_merge_to_whole_run(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 20_000, n_samples=2)
+    (tmp_path / "whole").mkdir()
+    Pipeline(Config(ref=str(ref_path), output=str(tmp_path / "whole"), minCov=5, maxDistance=300)).run(bed_paths)
+
+    options = ["-i", str(tmp_path / "beds"), "-r", str(ref_path), "-o", str(tmp_path / "out"), "-c", "5", "-d", "300"]
+    main(["plan", str(tmp_path / "shards.json"), "--unitSites", "500", "--", *options, "-f", "parquet"])
+    manifest = load_manifest(tmp_path / "shards.json")
+    assert len(manifest["units"]) > 2 * 22  # several ranges on the larger chromosomes
+
+    with pytest.raises(ValueError, match="not done"):
+        merge_units(manifest)
+
+    main(["run-shard", str(tmp_path / "shards.json"), "--unit", "0"])
+    main(["run-shard", str(tmp_path / "shards.json"), "--unit", manifest["units"][1]["id"]])
+    for unit in pending_units(manifest):
+        run_unit(manifest, unit)
+    main(["merge", str(tmp_path / "shards.json")])
+
+    for name in ["sample_0", "sample_1"]:
+        merged = pl.read_parquet(output_file(tmp_path / "out", name, "parquet"))
+        whole = pl.read_csv(output_file(tmp_path / "whole", name, "tsv"), separator="\t", schema=merged.schema)
+        assert_frame_equal(merged.sort(["chr", "start"]), whole.sort(["chr", "start"]))
+
+    samples = json.loads((tmp_path / "out" / "gimmecpg_manifest.json").read_text())["samples"]
+    assert sorted(samples) == ["sample_0", "sample_1"]
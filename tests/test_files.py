@@ -0,0 +1,193 @@
+import gzip
+import struct
+import zlib
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from gimmecpg_python.files import (
+    Saver,
+    clean_bed,
+    collapse_chunks,
+    collapse_gzip,
+    gzip_frames,
+    gzip_sites,
+    imputed_sites,
+    is_bgzf,
+    merge_observed,
+    output_file,
+    query_region,
+    read_files,
+    read_gzip,
+    sample_name,
+    save_files,
+    scan_output,
+    sink_files,
+    standard_dtypes,
+)
+
+LINES = [
+    "chrBase\tchr\tbase\tname\tscore\tstrand\ta\tb\tc\tcoverage\tmeth",
+    "chr1\t10\t11\t.\t0\t+\t.\t.\t.\t20\t80",
+    "chr1\t11\t12\t.\t0\t-\t.\t.\t.\t10\t50",
+    "chr1\t30\t31\t.\t0\t+\t.\t.\t.\t5\t100",
+    "chr2\t7\t8\t.\t0\t-\t.\t.\t.\t12\t0",
+]
+
+
+def write_bgzf(path, data, block_size=64):
+    """Minimal bgzip writer: small deflate blocks with a BC extra field and an EOF block."""
+    with open(path, "wb") as fh:
+        for i in range(0, len(data) + 1, block_size):
+            chunk = data[i : i + block_size]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+            payload = compressor.compress(chunk) + compressor.flush()
+            bsize = 18 + len(payload) + 8
+            header = b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff" + struct.pack("<H", 6) + b"BC"
+            fh.write(header + struct.pack("<HH", 2, bsize - 1) + payload)
+            fh.write(struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+
+
+def test_read_gzip_matches_plain(tmp_path):
+    data = ("\n".join(LINES) + "\n").encode()
+    (tmp_path / "s1.bed").write_bytes(data)
+    (tmp_path / "s1.bed.gz").write_bytes(gzip.compress(data))
+    write_bgzf(tmp_path / "s1.bgz.bed.gz", data)
+
+    assert is_bgzf(tmp_path / "s1.bgz.bed.gz")
+    assert not is_bgzf(tmp_path / "s1.bed.gz")
+    assert sample_name(tmp_path / "s1.bed.gz") == "s1"
+
+    expected = read_files(tmp_path / "s1.bed", 1, True).collect().sort(["chr", "start"])
+    for name in ["s1.bed.gz", "s1.bgz.bed.gz"]:
+        res = read_files(tmp_path / name, 1, True).collect().sort(["chr", "start"])
+        assert_frame_equal(res.drop("sample"), expected.drop("sample"))
+
+
+def test_read_gzip_small_windows(tmp_path):
+    data = ("\n".join(LINES)).encode()  # no trailing newline
+    write_bgzf(tmp_path / "s1.bed.gz", data, block_size=16)
+
+    res = read_gzip(tmp_path / "s1.bed.gz", chunk_size=40, threads=2).collect()
+    assert res["column_2"].to_list() == [10, 11, 30, 7]
+    assert res["column_11"].to_list() == [80, 50, 100, 0]
+
+
+def test_sink_files_formats(tmp_path):
+    pl.DataFrame(
+        {
+            "chr": ["2", "1", "1"],
+            "start": [5, 30, 10],
+            "end": [6, 31, 11],
+            "strand": ["+", None, "+"],
+            "sample": ["s1", "imputed", "s1"],
+            "avg": [10.0, 15.0, 20.0],
+        }
+    ).write_parquet(tmp_path / "res.parquet")
+    res = pl.scan_parquet(tmp_path / "res.parquet")
+
+    # the window keeps the plan out of the streaming engine; such results are spilled to be sunk
+    windowed = res.with_columns(pl.col("avg").forward_fill().over("chr"))
+    with pytest.raises(pl.exceptions.InvalidOperationError):
+        sink_files(windowed, "s1", tmp_path, "ipc")
+    for fmt in ["tsv", "parquet", "ipc"]:
+        assert sink_files(res, "s1", tmp_path, fmt) == "Saved s1"
+
+    assert pl.read_parquet(output_file(tmp_path, "s1", "parquet"))["start"].to_list() == [10, 30, 5]
+    assert pl.read_ipc(output_file(tmp_path, "s1", "ipc"))["start"].to_list() == [5, 30, 10]
+    assert pl.read_csv(output_file(tmp_path, "s1", "tsv"), separator="\t").height == 3
+
+
+def test_saver_reports_failures_per_sample(tmp_path):
+    output_file(tmp_path, "b", "tsv").mkdir()  # writing b fails
+    saved = []
+    with Saver(tmp_path, workers=2, max_pending=1, on_saved=saved.append) as saver:
+        for name in ["a", "b", "c"]:
+            saver.submit(name, pl.DataFrame({"chr": ["1"], "start": [1], "sample": [name]}))
+
+    assert sorted(saved) == ["a", "c"]
+    assert list(saver.errors) == ["b"]
+    assert pl.read_csv(output_file(tmp_path, "c", "tsv"), separator="\t")["sample"].to_list() == ["c"]
+
+
+def test_read_files_approx_quantile(tmp_path):
+    (tmp_path / "s1.bed").write_text("\n".join(LINES) + "\n")
+
+    expected = read_files(tmp_path / "s1.bed", 1, False).collect()
+    res = read_files(tmp_path / "s1.bed", 1, False, approx=True).collect(streaming=True)
+    assert_frame_equal(res, expected)
+
+
+def test_sorted_collapse_matches_join(tmp_path):
+    data = ("\n".join(LINES) + "\n").encode()
+    (tmp_path / "s1.bed").write_bytes(data)
+    write_bgzf(tmp_path / "s1.bed.gz", data, block_size=16)
+
+    expected = read_files(tmp_path / "s1.bed", 1, True).collect().sort(["chr", "start"])
+    for name in ["s1.bed", "s1.bed.gz"]:
+        res = read_files(tmp_path / name, 1, True, presorted=True).collect().sort(["chr", "start"])
+        assert_frame_equal(res, expected)
+
+    # chunks split between the two halves of a CpG
+    chunks = list(collapse_chunks(clean_bed(frame) for frame in gzip_frames(tmp_path / "s1.bed.gz", chunk_size=40)))
+    assert len(chunks) > 1
+    res = pl.concat(chunks)
+    assert res["strand"].to_list() == ["+/-", "+", "-"]
+    assert res["start"].to_list() == [10, 30, 6]
+    assert res["avg"].to_list() == [70.0, 100.0, 0.0]
+
+    data, counts = collapse_gzip(tmp_path / "s1.bed.gz", 12, chunk_size=40)
+    assert data.collect()["start"].to_list() == [10, 6]  # the site covered 5 times is dropped in its window
+    assert counts.collect()["count"].sum() == 3
+
+
+def test_imputed_output_region_lookup_and_merge(tmp_path):
+    res = pl.LazyFrame(
+        {
+            "chr": ["1", "1", "1", "2"],
+            "start": [10, 20, 30, 5],
+            "end": [11, 21, 31, 6],
+            "strand": ["+", None, None, "-"],
+            "sample": ["s1", "imputed", "imputed", "s1"],
+            "avg": [10.0, 15.0, 20.0, 30.0],
+        }
+    )
+    save_files(imputed_sites(res).collect(), tmp_path, "parquet", name="s1")
+    outfile = output_file(tmp_path, "s1", "parquet")
+
+    assert query_region(outfile, 1, 0, 30)["start"].to_list() == [20]
+    assert query_region(outfile, "1", 20, 31)["avg"].to_list() == [15.0, 20.0]
+    assert query_region(outfile, "2", 0, 100).height == 0
+
+    observed = res.filter(pl.col("sample") != "imputed").select(["chr", "start", "strand", "avg", "sample"])
+    merged = merge_observed(scan_output(outfile), observed, res.select(["chr", "start", "end"]), ["1", "2"]).collect()
+    assert_frame_equal(merged, standard_dtypes(res).sort(["chr", "start"]).collect())
+
+
+def test_gzip_sites_filtered_per_window(tmp_path):
+    lines = [LINES[0], *[f"chr1\t{i}\t{i + 1}\t.\t0\t+\t.\t.\t.\t{i % 7}\t{i}" for i in range(1, 3000)]]
+    data = ("\n".join(lines) + "\n").encode()
+    (tmp_path / "s1.bed").write_bytes(data)
+    write_bgzf(tmp_path / "s1.bed.gz", data, block_size=256)
+
+    data, counts = gzip_sites(tmp_path / "s1.bed.gz", 3, chunk_size=4096)
+    assert data.collect()["total_coverage"].min() == 3
+    assert counts.collect()["count"].sum() == 2999
+
+    for mincov in [0, 3]:
+        expected = read_files(tmp_path / "s1.bed", mincov, False).collect()
+        assert_frame_equal(read_files(tmp_path / "s1.bed.gz", mincov, False).collect(), expected)
+
+    spilled = tmp_path / "spill"
+    spilled.mkdir()
+    read_files(tmp_path / "s1.bed.gz", 3, True, tmpdir=spilled)
+    assert list(spilled.glob("gimmecpg_*/chunk_*.parquet"))
+
+
+def test_saver_frees_slot_when_submit_fails(tmp_path):
+    saver = Saver(tmp_path, workers=1)
+    saver.close()
+    with pytest.raises(RuntimeError):
+        saver.submit("a", pl.DataFrame({"sample": ["a"]}))  # the pool is shut down
+    assert saver.slots.acquire(blocking=False)
@@ -0,0 +1,110 @@
+import shutil
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from gimmecpg_python import impute
+from gimmecpg_python.files import read_files
+from gimmecpg_python.impute import (
+    H2OBackend,
+    NumpyBackend,
+    fillPredictions,
+    h2oFrame,
+    h2oResult,
+    mlScoring,
+    pooledTraining,
+    sampleTraining,
+)
+from gimmecpg_python.missing import missing_sites
+from gimmecpg_python.reference import build_reference, reference_meta, scan_reference
+from gimmecpg_python.synthetic import write_dataset
+
+
+def test_predictions_join_back_by_site():
+    lf = pl.LazyFrame(
+        {
+            "chr": ["1", "1", "1", "2"],
+            "start": [1, 2, 3, 1],
+            "end": [2, 3, 4, 2],
+            "strand": ["+", None, None, None],
+            "sample": ["s", None, None, None],
+            "avg": [50.0, None, None, None],
+            "b_dist": [0, 1, 2, 5],
+            "f_dist": [0, 3, 2, 5],
+        }
+    )
+    to_predict_lf = lf.filter(pl.col("avg").is_null())
+    prediction = pl.DataFrame({"chr": ["2", "1", "1"], "start": [1, 3, 2], "predict": [30.0, 120.0, 10.0]})
+
+    res = fillPredictions(lf, to_predict_lf, prediction, 0).collect().sort(["chr", "start"])
+    assert res["avg"].to_list() == [50.0, 10.0, 100.0, 30.0]  # clipped to 0-100
+    assert res["sample"].to_list() == ["s", "imputed", "imputed", "imputed"]
+
+
+def test_sample_training_balances_bins():
+    sizes = {1: 601, 2: 299, 3: 91, 4: 9}
+    bins = [b for b, size in sizes.items() for _ in range(size)]
+    lf = pl.LazyFrame({"f_dist_bins": bins, "b_dist_bins": bins, "site": range(len(bins))})
+
+    res = sampleTraining(lf, 100).collect()
+    assert res.height == 100
+    counts = dict(res.group_by("f_dist_bins").len().iter_rows())
+    for b, size in sizes.items():
+        assert abs(counts[b] - size * 100 / len(bins)) <= 1  # rare bins keep at least one site
+
+    assert res.equals(sampleTraining(lf, 100).collect())
+    assert not res.equals(sampleTraining(lf, 100, seed=2).collect())
+    assert sampleTraining(lf, 5000).collect().height == len(bins)
+
+
+def test_pooled_numpy_model_is_saved_and_reloaded(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 3000, n_samples=2)
+    index = build_reference(ref_path, None, tmp_path / "index")
+    ref = scan_reference(index)
+    chromosomes = list(reference_meta(index)["chromosomes"])
+    missing = [missing_sites(read_files(bed, 5, True), ref, chromosomes, 500) for bed in bed_paths]
+
+    backend = NumpyBackend()
+    path = pooledTraining(missing, backend, 500, False, tmp_path, trainRows=400)
+    assert path.exists()
+
+    loaded = NumpyBackend()
+    loaded.load(path)
+    expected = mlScoring(missing[1], backend, 500, False).collect().sort(["chr", "start"])
+    res = mlScoring(missing[1], loaded, 500, False).collect().sort(["chr", "start"])
+    assert_frame_equal(res, expected)
+    assert res["avg"].null_count() == 0
+    assert res["avg"].is_between(0, 100).all()
+
+
+def test_h2o_reset_only_removes_what_it_trained(monkeypatch):
+    removed = []
+    monkeypatch.setattr(impute.h2o, "remove", removed.extend)
+    monkeypatch.setattr(impute.h2o, "remove_all", lambda: pytest.fail("remove_all wipes loaded models"))
+    monkeypatch.setattr(impute, "h2oTrain", lambda training, maxTime, maxModels: ("leader", ["automl", "frame"]))
+
+    loaded = H2OBackend(60, 5)
+    loaded.model = "mojo"
+    loaded.reset()
+    assert loaded.model == "mojo"
+
+    compared = H2OBackend(60, 5)
+    compared.train(None)
+    compared.reset()
+    assert removed == ["automl", "frame"]
+    assert compared.model is None
+
+
+@pytest.mark.skipif(shutil.which("java") is None, reason="H2O needs a Java runtime")
+def test_h2o_frame_round_trip(tmp_path):
+    import h2o
+
+    h2o.init()
+    df = pl.DataFrame(
+        {"chr": ["1", "10", "X"], "start": [10, 248_956_422, 3], "predict": [0.5, 99.25, 12.0]},
+        schema_overrides={"start": pl.UInt64},
+    )
+    frame = h2oFrame(df, tmp_path / "in.parquet")
+    res = h2oResult(frame, tmp_path / "out.csv", df.select("chr", "start").schema)
+    assert_frame_equal(res, df)
@@ -0,0 +1,41 @@
+import polars as pl
+
+from gimmecpg_python.files import output_file
+from gimmecpg_python.manifest import RunManifest
+
+
+def test_pending_tracks_outputs_inputs_and_params(tmp_path):
+    bed = tmp_path / "s1.bed"
+    bed.write_text("header\nchr1\t1\t2\n")
+    out = tmp_path / "out"
+    out.mkdir()
+    params = {"minCov": 10, "mode": "fast"}
+
+    manifest = RunManifest(out, "ref", params, "tsv")
+    assert manifest.pending([bed]) == [bed]
+    pl.DataFrame({"a": [1]}).write_csv(output_file(out, "s1", "tsv"), separator="\t")
+    manifest.done("s1")
+
+    assert RunManifest(out, "ref", params, "tsv").pending([bed]) == []
+    assert RunManifest(out, "other", params, "tsv").pending([bed]) == [bed]
+    assert RunManifest(out, "ref", {**params, "minCov": 5}, "tsv").pending([bed]) == [bed]
+
+    bed.write_text("header\nchr1\t1\t2\nchr1\t3\t4\n")
+    assert RunManifest(out, "ref", params, "tsv").pending([bed]) == [bed]
+
+
+def test_done_keeps_samples_recorded_by_other_runs(tmp_path):
+    beds = [tmp_path / "s1.bed", tmp_path / "s2.bed"]
+    for bed in beds:
+        bed.write_text("header\nchr1\t1\t2\n")
+    out = tmp_path / "out"
+    out.mkdir()
+
+    first, second = (RunManifest(out, "ref", {}, "tsv") for _ in range(2))  # two runs sharing the output
+    first.pending(beds[:1])
+    second.pending(beds[1:])
+    for manifest, name in [(first, "s1"), (second, "s2")]:
+        pl.DataFrame({"a": [1]}).write_csv(output_file(out, name, "tsv"), separator="\t")
+        manifest.done(name)
+
+    assert RunManifest(out, "ref", {}, "tsv").pending(beds) == []
@@ -0,0 +1,56 @@
+import polars as pl
+
+from gimmecpg_python.missing import missing_sites
+
+
+def make_bed(sample, starts, avgs):
+    return pl.LazyFrame(
+        {
+            "chr": ["1"] * len(starts),
+            "start": starts,
+            "strand": ["+"] * len(starts),
+            "avg": avgs,
+            "sample": [sample] * len(starts),
+        },
+        schema_overrides={"start": pl.UInt64},
+    )
+
+
+REF = pl.LazyFrame(
+    {"chr": ["1"] * 5, "start": [1, 2, 3, 4, 5], "end": [2, 3, 4, 5, 6]},
+    schema_overrides={"start": pl.UInt64, "end": pl.UInt64},
+)
+
+
+def test_missing_sites():
+    res = missing_sites(make_bed("a", [2, 5], [10.0, 40.0]), REF, ["1"]).collect()
+
+    assert res["b_start"].to_list() == [None, 2, 2, 2, 5]
+    assert res["f_start"].to_list() == [2, 2, 5, 5, 5]
+    assert res["b_dist"].to_list() == [None, 0, 1, 2, 0]
+    assert res["f_meth"].to_list() == [10.0, 10.0, 40.0, 40.0, 40.0]
+
+
+def test_missing_sites_distance_and_chromosomes():
+    bed = pl.concat([make_bed("a", [1, 5], [10.0, 40.0]), make_bed("a", [2], [70.0]).with_columns(chr=pl.lit("2"))])
+    ref = pl.concat([REF, REF.with_columns(chr=pl.lit("2"))])
+
+    res = missing_sites(bed, ref, ["1", "2"]).collect()
+    assert res.filter(chr="2")["b_start"].to_list() == [None, 2, 2, 2, 2]  # nothing carried over from chr 1
+    assert res.filter(chr="2")["f_start"].to_list() == [2, 2, None, None, None]
+
+    res = missing_sites(bed, ref, ["1", "2"], dist=2).collect()
+    assert res.select("chr", "start").rows() == [("1", 1), ("1", 3), ("1", 5), ("2", 2)]
+    assert res.filter(chr="1", start=3).select("b_dist", "f_dist").row(0) == (2, 2)
+
+
+def test_off_reference_sites_are_not_neighbours():
+    ref = REF.filter(pl.col("start") != 3)  # e.g. blacklisted
+    bed = make_bed("a", [1, 3, 5], [0.0, 100.0, 0.0])
+    bed = pl.concat([bed, make_bed("a", [4], [100.0]).with_columns(start=pl.lit(4, pl.UInt64) * 10)])
+
+    res = missing_sites(bed, ref, ["1"]).collect()
+    assert res["start"].to_list() == [1, 2, 4, 5]
+    assert res["b_start"].to_list() == [1, 1, 1, 5]
+    assert res["f_start"].to_list() == [1, 5, 5, 5]
+    assert res["f_meth"].to_list() == [0.0, 0.0, 0.0, 0.0]
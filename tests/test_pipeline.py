@@ -0,0 +1,159 @@
+import gzip
+import json
+import tempfile
+import threading
+from http.server import HTTPServer
+from urllib.request import urlopen
+
+import polars as pl
+import pytest
+from polars.io.plugins import register_io_source
+from polars.testing import assert_frame_equal
+
+from gimmecpg_python import pipeline as pipeline_module
+from gimmecpg_python.files import merge_observed, output_file, read_files, scan_output, standard_dtypes
+from gimmecpg_python.pipeline import Config, Pipeline, training_samples
+from gimmecpg_python.service import handler
+from gimmecpg_python.synthetic import write_dataset
+
+
+def test_pipeline_runs_and_skips_done_samples(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000, n_samples=2)
+    out = tmp_path / "out"
+    out.mkdir()
+    pipeline = Pipeline(Config(ref=str(ref_path), output=str(out), maxDistance=500, minCov=5))
+
+    assert pipeline.run(bed_paths) == {"saved": ["sample_0", "sample_1"], "skipped": [], "failed": {}}
+    assert pl.read_csv(output_file(out, "sample_0", "tsv"), separator="\t").height > 0
+    assert pipeline.run(bed_paths[:1]) == {"saved": [], "skipped": ["sample_0"], "failed": {}}
+
+
+def test_service_imputes_posted_beds(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    out = tmp_path / "out"
+    out.mkdir()
+    pipeline = Pipeline(Config(ref=str(ref_path), output=str(out), minCov=5), keep_reference=True)
+    pipeline.prepare()
+    server = HTTPServer(("127.0.0.1", 0), handler(pipeline))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    try:
+        body = json.dumps({"beds": [str(bed) for bed in bed_paths]}).encode()
+        with urlopen(f"{url}/impute", data=body) as response:
+            assert json.load(response)["saved"] == ["sample_0"]
+        with urlopen(f"{url}/health") as response:
+            assert json.load(response)["status"] == "ok"
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert output_file(out, "sample_0", "tsv").exists()
+
+
+def test_service_leaves_no_temporary_files(tmp_path, monkeypatch):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    gz_path = bed_paths[0].with_suffix(".bed.gz")
+    gz_path.write_bytes(gzip.compress(bed_paths[0].read_bytes()))
+    tmpdir = tmp_path / "tmp"
+    tmpdir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(tmpdir))
+    out = tmp_path / "out"
+    out.mkdir()
+    pipeline = Pipeline(Config(ref=str(ref_path), output=str(out), minCov=5), keep_reference=True)
+    pipeline.prepare()
+    server = HTTPServer(("127.0.0.1", 0), handler(pipeline))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        for streaming in [False, True]:
+            pipeline.config.streaming = streaming
+            pipeline.config.rerun = True
+            body = json.dumps({"beds": [str(gz_path)]}).encode()
+            with urlopen(f"http://127.0.0.1:{server.server_port}/impute", data=body) as response:
+                assert json.load(response)["saved"] == ["sample_0"]
+            assert list(tmpdir.iterdir()) == []
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_pipeline_saves_imputed_sites_only(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    out = tmp_path / "out"
+    out.mkdir()
+    pipeline = Pipeline(Config(ref=str(ref_path), output=str(out), minCov=5, outputSites="imputed"))
+
+    assert pipeline.run(bed_paths)["saved"] == ["sample_0"]
+    saved = pl.read_csv(output_file(out, "sample_0", "tsv"), separator="\t")
+    assert saved.height > 0
+    assert saved["sample"].unique().to_list() == ["imputed"]
+
+
+def test_merged_imputed_output_matches_full_output(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    with open(bed_paths[0], "a") as bed:  # observed sites off the reference are not part of the output
+        bed.write("chrM\t5\t6\t.\t0\t+\t.\t.\t.\t20\t50\nchrX\t100\t101\t.\t0\t+\t.\t.\t.\t20\t50\n")
+    outputs = {}
+    for sites in ["all", "imputed"]:
+        outputs[sites] = tmp_path / sites
+        outputs[sites].mkdir()
+        output = str(outputs[sites])
+        config = Config(ref=str(ref_path), output=output, minCov=5, outputSites=sites, outputFormat="parquet")
+        pipeline = Pipeline(config)
+        pipeline.run(bed_paths)
+
+    imputed = scan_output(output_file(outputs["imputed"], "sample_0", "parquet"))
+    merged = merge_observed(imputed, read_files(bed_paths[0], 5, True), pipeline.ref, pipeline.chromosomes)
+    expected = standard_dtypes(scan_output(output_file(outputs["all"], "sample_0", "parquet")))
+    assert_frame_equal(merged.collect(), expected.collect())
+
+
+def test_streaming_run_sinks_same_result(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    for streaming in [False, True]:
+        out = tmp_path / f"streaming_{streaming}"
+        out.mkdir()
+        config = Config(ref=str(ref_path), output=str(out), maxDistance=500, minCov=5, streaming=streaming)
+        assert Pipeline(config).run(bed_paths)["saved"] == ["sample_0"]
+
+    expected = pl.read_csv(output_file(tmp_path / "streaming_False", "sample_0", "tsv"), separator="\t")
+    res = pl.read_csv(output_file(tmp_path / "streaming_True", "sample_0", "tsv"), separator="\t")
+    assert res.equals(expected)
+
+
+@pytest.mark.parametrize("options", [{"streaming": True}, {"memoryBudget": 1e-6}])
+def test_streamed_samples_read_their_input_once(tmp_path, monkeypatch, options):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    reads = []
+    scan_input = pipeline_module.scan_input
+
+    def counted_scan(*args, **kwargs):
+        lf = scan_input(*args, **kwargs)
+
+        def source(with_columns, predicate, n_rows, batch_size):
+            reads.append(1)
+            df = lf.collect()
+            if predicate is not None:
+                df = df.filter(predicate)
+            yield df.select(with_columns) if with_columns else df
+
+        return register_io_source(source, schema=lf.collect_schema())
+
+    monkeypatch.setattr(pipeline_module, "scan_input", counted_scan)
+    out = tmp_path / "out"
+    out.mkdir()
+    config = Config(ref=str(ref_path), output=str(out), maxDistance=500, minCov=5, **options)
+
+    assert Pipeline(config).run(bed_paths)["saved"] == ["sample_0"]
+    assert len(reads) == 1
+
+
+def test_training_samples_are_a_seeded_subsample(tmp_path):
+    beds = [tmp_path / f"sample_{i}.bed" for i in range(20)]
+    chosen = training_samples(beds, 5)
+    assert len(chosen) == 5
+    assert set(chosen) <= set(beds)
+    assert chosen != beds[:5]
+    assert training_samples(beds[::-1], 5) == chosen
+    assert training_samples(beds, 5, seed=2) != chosen
+    assert training_samples(beds[:3], 5) == beds[:3]
@@ -0,0 +1,99 @@
+import polars as pl
+import pytest
+
+from gimmecpg_python import reference
+from gimmecpg_python.cache import cache_input
+from gimmecpg_python.files import read_files
+from gimmecpg_python.pipeline import Config, Pipeline
+from gimmecpg_python.planner import plan_run, query_plans
+from gimmecpg_python.reference import build_reference, scan_reference
+from gimmecpg_python.synthetic import write_dataset
+
+
+def test_plan_run_estimates_rows_and_batches(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 20_000, n_samples=3)
+    config = Config(ref=str(ref_path), output=str(tmp_path), minCov=5, memoryBudget=1_000, maxConcurrent=2)
+
+    plan = plan_run(config, bed_paths)
+    assert plan["reference_index"] is None
+    assert plan["reference_rows"] == 20_000
+    assert plan["batches"] == [["sample_0", "sample_1"], ["sample_2"]]
+
+    index = build_reference(ref_path, None, tmp_path)
+    plan = plan_run(config, bed_paths)
+    assert plan["reference_index"] == str(index)
+    assert plan["reference_rows"] == scan_reference(index).select(pl.len()).collect().item()
+
+    observed = read_files(bed_paths[0], 5, True).collect().height
+    sample = plan["samples"]["sample_0"]
+    assert abs(sample["observed_rows"] - observed) < 0.05 * observed
+    assert sample["missing_rows"] == plan["reference_rows"] - sample["observed_rows"]
+    assert set(sample["stage_mb"]) == {"read_files", "missing_sites"}
+
+    pipeline = Pipeline(config)
+    pipeline.load_reference(index)
+    plans = query_plans(pipeline, bed_paths[:1])
+    assert "ASOF" in plans["sample_0"].upper()
+
+
+def test_index_is_found_without_hashing_the_reference(tmp_path, monkeypatch):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    index = build_reference(ref_path, None, tmp_path)
+
+    def no_hash(path, chunk_size=None):
+        raise AssertionError("the reference was hashed")
+
+    monkeypatch.setattr(reference, "file_hash", no_hash)
+    plan = plan_run(Config(ref=str(ref_path), output=str(tmp_path)), bed_paths)
+    assert plan["reference_index"] == str(index)
+
+
+def test_plans_follow_the_run_options(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    index = build_reference(ref_path, None, tmp_path)
+    cached = cache_input(bed_paths[0], 5, True, tmp_path / "cache")
+    config = Config(ref=str(ref_path), output=str(tmp_path), minCov=5, compact=True, inputCache=str(tmp_path / "cache"))
+
+    pipeline = Pipeline(config)
+    pipeline.load_reference(index)
+    plan = query_plans(pipeline, bed_paths)["sample_0"]
+    assert str(cached) in plan
+    assert "Enum" in plan
+
+
+def test_plan_skips_done_samples_and_estimates_shards(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000, n_samples=2)
+    out = tmp_path / "out"
+    out.mkdir()
+    config = Config(ref=str(ref_path), output=str(out), maxDistance=500, minCov=5)
+    Pipeline(config).run(bed_paths[:1])
+
+    plan = Pipeline(config).explain(bed_paths)
+    assert plan["skipped"] == ["sample_0"]
+    assert list(plan["samples"]) == ["sample_1"]
+
+    config.shards = 2
+    plan = plan_run(config, bed_paths)
+    assert plan["batches"] == []
+    assert set(plan["samples"]["sample_0"]["stage_mb"]) == {"split_sample", "impute_shard"}
+    assert plan["shards_mb"] == 2 * max(sample["peak_mb"] for sample in plan["samples"].values())
+
+
+def test_explain_does_not_impute(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    out = tmp_path / "out"
+    out.mkdir()
+    config = Config(ref=str(ref_path), output=str(out), machineLearning=True, backend="numpy", runTime=60)
+
+    plan = Pipeline(config).explain(bed_paths)
+    assert "h2oPrep" in plan["samples"]["sample_0"]["stage_mb"]
+    assert plan["ml_seconds"] == 60
+    assert not list(out.iterdir())
+
+
+def test_explain_rejects_sharded_machine_learning(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    config = Config(ref=str(ref_path), output=str(tmp_path), machineLearning=True, shards=2)
+
+    with pytest.raises(ValueError, match="--shards only supports genome-wide default imputation"):
+        Pipeline(config).explain(bed_paths)
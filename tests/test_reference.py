@@ -0,0 +1,79 @@
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from gimmecpg_python.files import read_files, standard_dtypes
+from gimmecpg_python.impute import fast_impute
+from gimmecpg_python.missing import missing_sites
+from gimmecpg_python.reference import build_reference, compact_schema, reference_meta, scan_reference
+
+
+def write_ref(tmp_path):
+    ref = tmp_path / "ref.parquet"
+    pl.DataFrame(
+        {
+            "chr": ["2", "1", "1", "X", "1", "2"],
+            "start": [5, 30, 10, 1, 20, 1],
+            "end": [6, 31, 11, 2, 21, 2],
+        }
+    ).write_parquet(ref)
+    blacklist = tmp_path / "blacklist.parquet"
+    pl.DataFrame({"chr": ["1"], "start": [20]}).write_parquet(blacklist)
+    return ref, blacklist
+
+
+def test_build_reference(tmp_path):
+    ref, blacklist = write_ref(tmp_path)
+    index = build_reference(ref, blacklist, tmp_path / "index")
+
+    res = scan_reference(index).collect()
+    assert res.schema == {"chr": pl.Utf8, "start": pl.UInt64, "end": pl.UInt64}
+    assert res.rows() == [("2", 1, 2), ("2", 5, 6), ("1", 10, 11), ("1", 30, 31)]
+    assert reference_meta(index)["chromosomes"]["1"]["rows"] == 2
+    assert scan_reference(index, ["1"]).collect()["chr"].to_list() == ["1", "1"]
+
+
+def test_build_reference_reused(tmp_path):
+    ref, blacklist = write_ref(tmp_path)
+    index = build_reference(ref, blacklist, tmp_path / "index")
+    mtime = (index / "index.json").stat().st_mtime_ns
+
+    assert build_reference(ref, blacklist, tmp_path / "index") == index
+    assert (index / "index.json").stat().st_mtime_ns == mtime
+    assert build_reference(ref, None, tmp_path / "index") != index
+
+
+def test_missing_sites_from_index(tmp_path):
+    ref, blacklist = write_ref(tmp_path)
+    index = build_reference(ref, blacklist, tmp_path / "index")
+    bed = pl.LazyFrame(
+        {"chr": ["1"], "start": [10], "strand": ["+"], "avg": [20.0], "sample": ["s"]},
+        schema_overrides={"start": pl.UInt64},
+    )
+
+    res = missing_sites(bed, scan_reference(index, ["1"]), ["1"]).collect()
+    assert res.select("start", "avg", "b_start", "b_dist").rows() == [(10, 20.0, 10, 0), (30, None, 10, 20)]
+
+
+def test_compact_schema_round_trip(tmp_path):
+    ref, blacklist = write_ref(tmp_path)
+    index = build_reference(ref, blacklist, tmp_path / "index")
+    bed = tmp_path / "s.bed"
+    bed.write_text(
+        "header\n"
+        "chr1\t10\t11\t.\t0\t+\t.\t.\t.\t20\t80\n"
+        "chr2\t5\t6\t.\t0\t+\t.\t.\t.\t21\t30\n"
+        "chrX\t1\t2\t.\t0\t+\t.\t.\t.\t22\t50\n"  # not in the index
+        "chr2\t9\t10\t.\t0\t+\t.\t.\t.\t500\t50\n"  # above the coverage quantile
+    )
+    schema = compact_schema(index)
+
+    observed = read_files(bed, 1, True, schema).collect()
+    assert observed.schema["chr"] == pl.Enum(["2", "1"])
+    assert sorted(observed["chr"].to_list()) == ["1", "2"]
+
+    def run(schema):
+        chromosomes = list(reference_meta(index)["chromosomes"])
+        lf = missing_sites(read_files(bed, 1, True, schema), scan_reference(index, schema=schema), chromosomes)
+        return standard_dtypes(fast_impute(lf, 0)).collect()
+
+    assert_frame_equal(run(schema), run(None))
@@ -0,0 +1,34 @@
+import polars as pl
+
+from gimmecpg_python.reference import build_reference, scan_reference
+from gimmecpg_python.regions import chromosome_filter, in_regions, merge_regions, read_regions
+
+
+def test_merge_and_membership(tmp_path):
+    path = tmp_path / "regions.bed"
+    path.write_text("# panel\nchr1\t10\t20\tp1\nchr1\t25\t30\tp2\nchr2\t5\t6\tp3\n")
+    regions = read_regions(path)
+
+    assert merge_regions(regions).rows() == [("1", 10, 20), ("1", 25, 30), ("2", 5, 6)]
+    assert merge_regions(regions, flank=3).rows() == [("1", 7, 33), ("2", 2, 9)]
+
+    sites = pl.DataFrame({"chr": ["1", "1", "1", "1", "2", "2", "3"], "start": [9, 10, 19, 20, 5, 6, 5]})
+    res = sites.filter(in_regions(merge_regions(regions), ["1", "2"]))
+    assert res.rows() == [("1", 10), ("1", 19), ("2", 5)]
+
+    coarse, exact = chromosome_filter(merge_regions(regions), "1", limit=1)
+    assert sites.filter(chr="1").filter(coarse)["start"].to_list() == [10, 19, 20]
+    assert sites.filter(chr="1").filter(coarse).filter(exact)["start"].to_list() == [10, 19]
+    assert chromosome_filter(merge_regions(regions), "3") is None
+
+
+def test_scan_reference_regions(tmp_path):
+    ref = tmp_path / "ref.parquet"
+    pl.DataFrame({"chr": ["1"] * 100 + ["2"] * 10, "start": list(range(0, 200, 2)) + list(range(10))}).with_columns(
+        end=pl.col("start") + 1
+    ).write_parquet(ref)
+    index = build_reference(ref, None, tmp_path)
+    regions = merge_regions(pl.DataFrame({"chr": ["1", "1"], "start": [10, 150], "end": [15, 152]}))
+
+    res = scan_reference(index, regions=regions).collect()
+    assert res.rows() == [("1", 10, 11), ("1", 12, 13), ("1", 14, 15), ("1", 150, 151)]
@@ -0,0 +1,30 @@
+import numpy as np
+
+from gimmecpg_python.regressor import NumpyRegressor
+
+
+def make_data(n=5000, seed=1):
+    rng = np.random.default_rng(seed)
+    columns = [rng.uniform(0, 5, n) for _ in range(6)]
+    y = 10 + 3 * columns[0] - 2 * columns[2] * columns[3] + columns[5] ** 2
+    return columns, y
+
+
+def test_fit_predict():
+    columns, y = make_data()
+    model = NumpyRegressor(alpha=1e-6, chunk_size=700).fit(columns, y)
+
+    np.testing.assert_allclose(model.predict(columns), y, atol=1e-6)
+
+
+def test_missing_features_and_roundtrip(tmp_path):
+    columns, y = make_data()
+    columns[4] = np.where(columns[4] > 4, np.nan, columns[4])
+    model = NumpyRegressor().fit(columns, y)
+
+    model.save(tmp_path / "model.npz")
+    loaded = NumpyRegressor.load(tmp_path / "model.npz")
+
+    pred = loaded.predict(columns)
+    assert np.isfinite(pred).all()
+    np.testing.assert_allclose(pred, model.predict(columns))
@@ -0,0 +1,48 @@
+import json
+
+import polars as pl
+import pytest
+
+from gimmecpg_python.pipeline import Config, Pipeline
+from gimmecpg_python.report import REPORT, RunReport
+from gimmecpg_python.synthetic import write_dataset
+
+
+def test_stages_are_recorded_and_written(tmp_path):
+    report = RunReport()
+    with report.sample("s1"):
+        with report.stage("read", rows_in=10) as record:
+            record["rows_out"] = 7
+        with pytest.raises(ValueError), report.stage("fail"):
+            raise ValueError
+    with report.stage("merge", sample="all"):
+        pass
+    report.include_plans = True
+    report.plan("s1", pl.LazyFrame({"a": [1]}).select(pl.col("a") + 1))
+
+    report.write(tmp_path / "report.json", {"minCov": 5})
+    written = json.loads((tmp_path / "report.json").read_text())
+    stages = [(r["sample"], r["stage"], r["rows_in"], r["rows_out"]) for r in written["stages"]]
+    assert stages == [("s1", "read", 10, 7), ("s1", "fail", None, None), ("all", "merge", None, None)]
+    assert all(r["seconds"] >= 0 and r["peak_rss_mb"] > 0 for r in written["stages"])
+    assert written["params"] == {"minCov": 5}
+    assert "s1" in written["plans"]
+
+    report.reset()
+    assert report.records == []
+    assert report.plans == {}
+
+
+def test_pipeline_writes_report(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000)
+    out = tmp_path / "out"
+    out.mkdir()
+    config = Config(ref=str(ref_path), output=str(out), maxDistance=500, minCov=5, report=str(tmp_path / "r.json"))
+    REPORT.reset()  # the report is shared by every run in this process
+    Pipeline(config).run(bed_paths)
+
+    written = json.loads((tmp_path / "r.json").read_text())
+    assert written["params"]["minCov"] == 5
+    collect = [r for r in written["stages"] if r["stage"] == "collect"]
+    assert [r["samples"] for r in collect] == [["sample_0"]]
+    assert collect[0]["rows_out"][0] > 0
@@ -0,0 +1,24 @@
+import gzip
+
+from gimmecpg_python.scheduler import estimate_rows, plan_batches
+
+
+def test_estimate_rows(tmp_path):
+    lines = b"".join(b"chr1\t%07d\t%07d\t.\t0\t+\t.\t.\t.\t12\t50\n" % (i, i + 1) for i in range(200_000))
+    bed = tmp_path / "s.bed"
+    bed.write_bytes(lines)
+    bed_gz = tmp_path / "s.bed.gz"
+    bed_gz.write_bytes(gzip.compress(lines))
+
+    assert abs(estimate_rows(bed) - 200_000) < 2_000
+    assert abs(estimate_rows(bed_gz) - 200_000) < 20_000
+
+
+def test_plan_batches():
+    estimates = {"a": 40, "b": 40, "c": 40, "d": 500, "e": 10}
+    batches, oversized = plan_batches(list(estimates), estimates, 100, 10)
+    assert batches == [["a", "b"], ["c", "e"]]
+    assert oversized == ["d"]
+
+    batches, _ = plan_batches(list(estimates), estimates, 1000, 2)
+    assert batches == [["a", "b"], ["c", "d"], ["e"]]
@@ -0,0 +1,20 @@
+import polars as pl
+
+from gimmecpg_python.files import output_file
+from gimmecpg_python.pipeline import Config, Pipeline
+from gimmecpg_python.synthetic import write_dataset
+
+
+def test_sharded_run_matches_whole_run(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000, n_samples=2)
+    for shards in [0, 2]:
+        out = tmp_path / f"shards_{shards}"
+        out.mkdir()
+        config = Config(ref=str(ref_path), output=str(out), maxDistance=500, minCov=5, shards=shards)
+        assert Pipeline(config).run(bed_paths)["saved"] == ["sample_0", "sample_1"]
+
+    for name in ["sample_0", "sample_1"]:
+        expected = pl.read_csv(output_file(tmp_path / "shards_0", name, "tsv"), separator="\t")
+        res = pl.read_csv(output_file(tmp_path / "shards_2", name, "tsv"), separator="\t")
+        assert res.equals(expected)
+    assert not list((tmp_path / "shards_2").glob(".gimmecpg_shards_*"))  # work directory removed
@@ -0,0 +1,28 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from gimmecpg_python.sketch import RELATIVE_ACCURACY, approx_quantile, sketch, with_quantile
+
+
+@pytest.mark.parametrize("q", [0.5, 0.99, 0.999])
+def test_approx_quantile_within_bound(q):
+    values = np.random.default_rng(1).lognormal(3, 1.5, 50_000)
+    lf = pl.LazyFrame({"coverage": values})
+
+    exact = with_quantile(lf, "coverage", q, "quant").collect()["quant"][0]
+    approx = with_quantile(lf, "coverage", q, "quant", approx=True).collect(streaming=True)
+    assert approx.height == 50_000
+    assert abs(approx["quant"][0] - exact) <= RELATIVE_ACCURACY * exact
+
+
+def test_sketches_merge_and_handle_zeros():
+    lf = pl.LazyFrame({"error": [0.0, 0.0, 0.0, None, 2.0, 40.0]})
+    assert approx_quantile(lf, "error", 0.5).collect().item() == 0.0
+
+    halves = [sketch(lf.slice(0, 3), "error"), sketch(lf.slice(3), "error")]
+    merged = pl.concat(halves).group_by("bucket").agg(pl.col("count").sum())
+    assert merged.collect().sort("bucket").equals(sketch(lf, "error").collect().sort("bucket"))
+
+    with pytest.raises(ValueError, match="relative accuracy"):
+        approx_quantile(lf, "error", 0.5, alpha=1)
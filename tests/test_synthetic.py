@@ -0,0 +1,31 @@
+import polars as pl
+
+from gimmecpg_python.files import read_files
+from gimmecpg_python.synthetic import make_reference, make_sample, write_dataset
+
+
+def test_make_reference():
+    ref = make_reference(5000, n_chromosomes=3, seed=2)
+
+    assert ref.height == 5000
+    assert ref["chr"].unique().sort().to_list() == ["1", "2", "3"]
+    assert ref.group_by("chr").agg(pl.col("start").diff().min())["start"].min() >= 2
+    assert ref.equals(make_reference(5000, n_chromosomes=3, seed=2))
+
+
+def test_make_sample_missingness():
+    ref = make_reference(20000, seed=3)
+    sample = make_sample(ref, coverage=30, missingness=0.4, seed=4)
+
+    observed = sample.filter(pl.col("strand") == "+").height / ref.height
+    assert 0.55 < observed < 0.65
+    assert sample["percent_methylated"].max() <= 100
+
+
+def test_write_dataset_readable(tmp_path):
+    ref_path, bed_paths = write_dataset(tmp_path, 2000, n_samples=2)
+
+    assert pl.read_parquet(ref_path).height == 2000
+    res = read_files(bed_paths[1], 5, True).collect()
+    assert res["sample"].unique().to_list() == ["sample_1"]
+    assert res.join(pl.read_parquet(ref_path), on=["chr", "start"], how="anti").is_empty()